@@ -1,10 +1,10 @@
 import os.path
 
 
-import fipy as fp
 import matplotlib.pyplot as plt
 import numpy as np
 from .dicttable import DictTable
+from .meshes import record_grid, record_grid_key
 
 class _BaseViewer(object):
     def plot(self, indices=[0], filename=None, times=None, cutoffvalue=-1, mirror=False, cutoff=True, labels=False, show=True, xlim=12e-6, ylim=-60e-6):
@@ -35,14 +35,8 @@ class _BaseSingleViewer(_BaseViewer):
             datafile = os.path.join(record.datastore.root, record.output_data[0].path)
         self.record = record
         self.data = DictTable(datafile, 'r')
-        data0 = self.data[0]
-
-        mesh = fp.Grid2D(nx=data0['nx'], ny=data0['ny'], dx=data0['dx'], dy=data0['dy'])
-
-        self.dy = mesh.dy
-        self.shape = (mesh.ny, mesh.nx)
-        self.x = mesh.x.value
-        self.y = mesh.y.value
+        self.featureDepth = featureDepth
+        self.setGrid(0)
         if ax is None:
             fig = plt.figure()
             self.ax = fig.add_subplot(111)
@@ -52,15 +46,28 @@ class _BaseSingleViewer(_BaseViewer):
         self.mirror = mirror
 
         self.indexJump = indexJump
-        self.featureDepth = featureDepth
 
+    def setGrid(self, index):
+        """Set the coordinates to the grid of the record at `index`.
+        """
+        record = self.data[index]
+        args = (record['nx'], record['ny'], record['dx'], record['dy'])
+        origin = record.get('origin')
+        key = record_grid_key(*args, origin=origin)
+        if key != getattr(self, 'gridKey', None):
+            self.gridKey = key
+            mesh = record_grid(*args, origin=origin, featureDepth=self.featureDepth)
+            self.dy = mesh.dy
+            self.shape = (mesh.ny, mesh.nx)
+            self.x = mesh.x.value
+            self.y = mesh.y.value
 
     def flip(self, a, scale, negate=False):
         a = np.reshape(a, self.shape)
         a = a.swapaxes(0,1)
         return a * scale
 
-    def plotSetup(self, indices=[0], times=None, maxFeatureDepth=None, cutoff=None, xlim=12e-6, ylim=-60e-6):
+    def plotSetup(self, indices=[0], times=None, cutoff=None, xlim=12e-6, ylim=-60e-6):
         if times is not None:
             indices = []
             index = 0
@@ -74,16 +81,12 @@ class _BaseSingleViewer(_BaseViewer):
         delta = 150e-6
 
         featureDepth = self.featureDepth
-        if maxFeatureDepth is None:
-            maxFeatureDepth = featureDepth
 
-        y0 = maxFeatureDepth + np.amin(self.dy) * 10
         scale = 1e+6
-        y0 = y0 * scale
         ymin = ylim * scale
         ymax = -ymin * 0.1
 
-        y = self.flip(self.y, scale) - y0 + (maxFeatureDepth - featureDepth) * scale
+        y = self.flip(self.y, scale)
 
         self._plot(y, scale, indices, xlim=xlim)
 
@@ -6,7 +6,8 @@ import numpy as np
 class ContourViewer(_BaseSingleViewer):
     def _plot(self, y, scale, indices, xlim=12e-6):
         import brewer2mpl
-        x = self.flip(self.x, scale, negate=True)
+        self.setGrid(0)
+        x, y = self._coordinates(scale)
 
         phi0 = self.data[0]['distance']
         phi0 = self.flip(phi0, scale)
@@ -14,8 +15,6 @@ class ContourViewer(_BaseSingleViewer):
         set1 = brewer2mpl.get_map('BuGn', 'sequential', 9).mpl_colors
 
         if self.mirror:
-            x = np.concatenate((-x[::-1], x))
-            y = np.concatenate((y[::-1], y))
             phi0 =  np.concatenate((phi0[::-1], phi0))
 
         self.ax.contourf(x,y, phi0, (-1e+10, 0, 1e+10), colors=(set1[4], set1[1]))
@@ -26,6 +25,8 @@ class ContourViewer(_BaseSingleViewer):
 
         for index in indices[1:]:
 
+            self.setGrid(index)
+            x, y = self._coordinates(scale)
             phi = self.data[index]['distance']
             phi = self.flip(phi, scale)
 
@@ -52,6 +53,14 @@ class ContourViewer(_BaseSingleViewer):
         self.ax.set_xticks(())
         self.ax.set_yticks(())
 
+    def _coordinates(self, scale):
+        x = self.flip(self.x, scale, negate=True)
+        y = self.flip(self.y, scale)
+        if self.mirror:
+            x = np.concatenate((-x[::-1], x))
+            y = np.concatenate((y[::-1], y))
+        return x, y
+
 
 if __name__ == '__main__':
     records = getSMTRecords(tags=['serialnumber18'], parameters={'Nx' : 600})
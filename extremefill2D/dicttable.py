@@ -16,7 +16,7 @@ class DictTable:
         self.h5filename = h5filename
 
     def haskey(self, index):
-        h5file = tables.openFile(self.h5filename, mode='a')
+        h5file = tables.open_file(self.h5filename, mode='a')
         groupName = self.IDprefix + str(index)
         _haskey =  hasattr(h5file.root, groupName)
         h5file.close()
@@ -29,7 +29,7 @@ class DictTable:
         groupName = self.IDprefix + str(index)
 
         if hasattr(h5file.root, groupName):
-            group = h5file.root._f_getChild(groupName)
+            group = h5file.root._f_get_child(groupName)
             group._f_remove(recursive=True)
 
         group = h5file.create_group(h5file.root, groupName)
@@ -1,11 +1,78 @@
+from collections import OrderedDict
+
+
 import fipy as fp
 import fipy.solvers.scipy as scipy_solvers
+from fipy.tools import numerix
 from extremefill2D.variables import AreaVariable
+from extremefill2D.solvers import get_solver
+from extremefill2D.stencil import StencilOperator
 import numpy as np
 import scipy
 import scipy.optimize
 
 
+def normalize_residual(residual, RHSvector):
+    """Scale a residual by the norm of the right hand side.
+
+    >>> print(normalize_residual(1e-3, np.array([3., 4.])))
+    0.0002
+    >>> print(normalize_residual(0., np.zeros(2)))
+    0.0
+    """
+    RHSnorm = np.sqrt(np.sum(np.array(RHSvector)**2))
+    return residual / RHSnorm if RHSnorm > 0 else residual
+
+
+def converged(residuals, keys, tol):
+    """Check whether the residual of every equation has dropped below
+    its tolerance.
+
+    Args:
+        residuals: a list with the residuals of each sweep
+        keys: the (equation name, residual key) pairs to check
+        tol: the tolerance or a dict of tolerances by equation name,
+            equations missing from the dict are not checked
+
+    Returns:
+        whether the last sweep has converged
+
+    >>> keys = [('potential', 'psi'), ('cupric', 'c')]
+    >>> residuals = [dict(psi=1.0, c=1.0), dict(psi=1e-3, c=0.1)]
+    >>> converged(residuals, keys, 1e-2)
+    False
+    >>> converged(residuals, keys, dict(potential=1e-2))
+    True
+    """
+    for name, key in keys:
+        key_tol = tol.get(name) if isinstance(tol, dict) else tol
+        if key_tol is not None and residuals[-1][key] > key_tol:
+            return False
+    return True
+
+
+def converge_sweeps(sweep, keys, params):
+    """Sweep the equations until converged or `params.sweeps` is
+    reached.
+
+    Args:
+        sweep: a function that sweeps the equations once and returns
+            the residuals
+        keys: the (equation name, residual key) pairs to check
+        params: the parameters with sweeps and tol
+
+    Returns:
+        a list with the residuals of each sweep
+
+    """
+    residuals = []
+    for _ in range(params.sweeps):
+        residuals.append(sweep())
+        if converged(residuals, keys, params.tol):
+            break
+    return residuals
+
+
 class AdvectionEquation(object):
     def __init__(self, params, variables):
         self.equation = fp.TransientTerm() + fp.AdvectionTerm(variables.extension)
@@ -16,6 +83,126 @@ class AdvectionEquation(object):
         self.equation.solve(self.var, dt=dt, solver=self.solver)
 
 
+class ExplicitAdvectionEquation(object):
+    """Explicit upwind update of the level set on the (ny, nx) grid.
+
+    With `order=2` the upwind differences are corrected with the
+    minmod limited second differences used by fipy's `AdvectionTerm`
+    (an ENO2 scheme) and the update reproduces `AdvectionEquation`
+    without assembling or factorizing a matrix. `order=1` is the
+    first order upwind scheme of `FirstOrderAdvectionTerm`.
+
+    With a narrow band only the cells in the band are updated and the
+    differences are only calculated on the rows and columns spanning
+    the band, padded by enough cells for the stencil to be the same as
+    on the whole grid.
+    """
+    halo = 3
+
+    def __init__(self, params, variables, order=2):
+        self.var = variables.distance
+        self.extension = variables.extension
+        self.order = order
+        mesh = self.var.mesh
+        nx, ny = mesh.nx, mesh.ny
+        self.shape = (ny, nx)
+        nh = (ny + 1) * nx
+        faceAreas = np.array(mesh._faceAreas)
+        alpha = np.array(mesh._faceToCellDistanceRatio)
+        volumes = np.array(mesh.cellVolumes).reshape(ny, nx)
+        x, y = [np.array(c).reshape(ny, nx) for c in mesh.cellCenters]
+        ## geometry for each direction with the direction along axis 0
+        self.geometry = ((faceAreas[:nh].reshape(ny + 1, nx),
+                          alpha[:nh].reshape(ny + 1, nx)[1:-1],
+                          volumes,
+                          np.diff(y, axis=0)),
+                         (faceAreas[nh:].reshape(ny, nx + 1).T,
+                          alpha[nh:].reshape(ny, nx + 1).T[1:-1],
+                          volumes.T,
+                          np.diff(x, axis=1).T))
+
+    def _gradient(self, phi, areas, alpha, volumes):
+        faceValues = np.concatenate((phi[:1], (phi[1:] - phi[:-1]) * alpha + phi[:-1], phi[-1:]))
+        faceFlux = faceValues * areas
+        return (faceFlux[1:] - faceFlux[:-1]) / volumes
+
+    def _minmod(self, a, b):
+        return np.where(a * b < 0, 0., np.where(abs(a) > abs(b), b, a))
+
+    def _differences(self, phi, geometry):
+        areas, alpha, volumes, dAP = geometry
+        jump = (phi[1:] - phi[:-1]) / dAP
+        forward = np.zeros_like(phi)
+        backward = np.zeros_like(phi)
+        forward[:-1] = jump
+        backward[1:] = -jump
+        if self.order == 2:
+            grad = self._gradient(phi, areas, alpha, volumes)
+            forward[:-1] -= self._minmod(2 * (jump - grad[:-1]) / dAP,
+                                         2 * (grad[1:] - jump) / dAP) * dAP / 2
+            backward[1:] -= self._minmod(2 * (grad[1:] - jump) / dAP,
+                                         2 * (jump - grad[:-1]) / dAP) * dAP / 2
+        return forward, backward
+
+    def _span(self, mask, axis):
+        """The slice along `axis` covering the cells in `mask` and the
+        halo.
+        """
+        ids = np.flatnonzero(mask.any(axis=1 - axis))
+        return slice(max(ids[0] - self.halo, 0), min(ids[-1] + self.halo + 1, mask.shape[axis]))
+
+    def _block(self, geometry, span, other):
+        """The geometry for the cells `span` along axis 0 and `other`
+        along axis 1.
+        """
+        areas, alpha, volumes, dAP = geometry
+        start, stop = span.indices(len(volumes))[:2]
+        return (areas[start:stop + 1, other],
+                alpha[start:stop - 1, other],
+                volumes[start:stop, other],
+                dAP[start:stop - 1, other])
+
+    def solve(self, dt):
+        phi = np.array(self.var.value).reshape(self.shape)
+        band = getattr(self.var, 'band', None)
+        if band is None or band.all():
+            rows, cols, band = slice(None), slice(None), None
+        else:
+            band = band.reshape(self.shape)
+            rows, cols = self._span(band, 0), self._span(band, 1)
+            band = band[rows, cols]
+        block = phi[rows, cols]
+        coeff = np.array(self.extension).reshape(self.shape)[rows, cols]
+        yDifferences = self._differences(block, self._block(self.geometry[0], rows, cols))
+        xDifferences = [d.T for d in self._differences(block.T, self._block(self.geometry[1], cols, rows))]
+        differences = yDifferences + tuple(xDifferences)
+        minsq = np.sqrt(sum(np.minimum(d, 0)**2 for d in differences))
+        maxsq = np.sqrt(sum(np.maximum(d, 0)**2 for d in differences))
+        speed = coeff * ((coeff > 0) * minsq + (coeff < 0) * maxsq)
+        if band is not None:
+            speed = np.where(band, speed, 0.)
+        phi[rows, cols] = block - float(dt) * speed
+        self.var.setValue(phi.flatten())
+
+
+def get_advection_equation(params, variables):
+    """Create the level set advection equation.
+
+    The optional `params.advection` is "eno2" (the default) or
+    "upwind" for the explicit update or "implicit" for the fipy
+    `AdvectionEquation`.
+    """
+    scheme = getattr(params, 'advection', 'eno2')
+    if scheme == 'implicit':
+        return AdvectionEquation(params, variables)
+    elif scheme == 'eno2':
+        return ExplicitAdvectionEquation(params, variables, order=2)
+    elif scheme == 'upwind':
+        return ExplicitAdvectionEquation(params, variables, order=1)
+    else:
+        raise ValueError("unknown advection scheme {0}".format(scheme))
+
+
 class AppliedPotentialEquation(object):
     def __init__(self, params, variables):
         self.var = variables.appliedPotential
@@ -33,7 +220,7 @@ class AppliedPotentialEquation(object):
         I0 = float(self.I0)
 
         f = lambda e: b0 * np.exp(-c0 * e) - b1 * np.exp(c1 * e) - I0
-        fprime = lambda e: -b0 * c0 * np.exp(c0 * e) - b1 * c1 * np.exp(-c1 * e)
+        fprime = lambda e: -b0 * c0 * np.exp(-c0 * e) - b1 * c1 * np.exp(c1 * e)
 
         delta = scipy.optimize.fsolve(f, 0., fprime=fprime)[0]
         delta = np.sign(delta) * min(abs(float(self.var)) / 10, abs(delta))
@@ -44,10 +231,40 @@ class AppliedPotentialEquation(object):
 
 class SweepEquation(object):
     def sweep(self, dt):
-        return self.equation.sweep(self.var, dt=dt, solver=self.solver)
+        residual = self.equation.sweep(self.var, dt=dt, solver=self.solver)
+        return normalize_residual(residual, self.solver.RHSvector)
+
+    def newStep(self):
+        """Called when the old values are updated or reverted at the
+        start of a time step.
+        """
+        pass
+
+
+def potential_transient_coeff(params, variables):
+    """The coefficient of the transient term in the potential equation.
+
+    With `params.quasi_steady_potential` the double layer charging term
+    is dropped. The term in the metal is kept as the metal cells have
+    no other terms and just hold their old value.
+    """
+    metal = variables.distance < 0
+    if getattr(params, 'quasi_steady_potential', False):
+        return metal
+    return params.capacitance * variables.surface + metal
 
 
 class PotentialEquation(SweepEquation):
+    """Potential equation.
+
+    In quasi-steady mode (`params.quasi_steady_potential`) the
+    potential is solved once per time step, on the first sweep after
+    the old values are updated or reverted, starting from the previous
+    solution. Further sweeps in the step return a zero residual so that
+    the potential does not hold up the convergence test.
+    """
+    name = 'potential'
+
     def __init__(self, params, variables):
         distance = variables.distance
         mesh = distance.mesh
@@ -56,16 +273,89 @@ class PotentialEquation(SweepEquation):
         upper[ID] = params.kappa / mesh.dy[-1] / (params.deltaRef - params.delta + mesh.dy[-1])
         surface = variables.surface
 
-        self.equation = fp.TransientTerm(params.capacitance * surface + (distance < 0)) == \
+        self.equation = fp.TransientTerm(potential_transient_coeff(params, variables)) == \
           fp.DiffusionTerm(params.kappa * variables.harmonic) \
         - surface * (variables.currentDensity - variables.potential * variables.currentDerivative) \
         - fp.ImplicitSourceTerm(surface * variables.currentDerivative) \
         - upper * variables.appliedPotential - fp.ImplicitSourceTerm(upper)
-        self.solver = scipy_solvers.LinearLUSolver()
+        self.solver = get_solver(params, self.name)
         self.var = variables.potential
+        self.upper = upper
+        self.quasi_steady = getattr(params, 'quasi_steady_potential', False)
+        self.solve_count = 0
+        self._solved = False
+
+    def newStep(self):
+        self._solved = False
+
+    def _stepSolved(self):
+        return self.quasi_steady and self._solved
+
+    def sweep(self, dt):
+        if self._stepSolved():
+            return 0.
+        self.solve_count += 1
+        residual = super(PotentialEquation, self).sweep(dt)
+        self._solved = True
+        return residual
+
+
+class GalvanostaticPotentialEquation(PotentialEquation):
+    """Potential equation with the applied potential as an unknown.
+
+    The applied potential is found with the potential so that the
+    total current is `params.current`. Each sweep solves the bordered
+    linear system for the potential and the applied potential by
+    block elimination. The sensitivity of the potential to the applied
+    potential is solved with the same operator and then the change in
+    the applied potential that gives the required linearized current
+    is calculated in closed form. The change is limited to
+    `params.max_potential_step` to damp the Newton iterations.
+    """
+    def __init__(self, params, variables):
+        super(GalvanostaticPotentialEquation, self).__init__(params, variables)
+        distance = variables.distance
+        surface = variables.surface
+        self.variables = variables
+        self.appliedPotential = variables.appliedPotential
+        self.current = params.current
+        self.max_step = getattr(params, 'max_potential_step', 0.1)
+        self.sensitivity = fp.CellVariable(mesh=distance.mesh, hasOld=True)
+        self.sensitivityEquation = fp.TransientTerm(potential_transient_coeff(params, variables)) == \
+          fp.DiffusionTerm(params.kappa * variables.harmonic) \
+        - fp.ImplicitSourceTerm(surface * variables.currentDerivative) \
+        - self.upper - fp.ImplicitSourceTerm(self.upper)
+        self.sensitivitySolver = get_solver(params, self.name)
+        self.potentialStep = 0.
+
+    def sweep(self, dt):
+        if self._stepSolved():
+            return 0.
+        variables = self.variables
+        areas = np.array(variables.distance.cellInterfaceAreas)
+        potential = np.array(self.var).copy()
+        currentDensity = np.array(variables.currentDensity).copy()
+        currentDerivative = np.array(variables.currentDerivative).copy()
+
+        self.sensitivity.setValue(0.)
+        self.sensitivity.updateOld()
+        self.sensitivityEquation.sweep(self.sensitivity, dt=dt, solver=self.sensitivitySolver)
+        residual = super(GalvanostaticPotentialEquation, self).sweep(dt)
+
+        sensitivity = np.array(self.sensitivity)
+        current = np.sum(areas * (currentDensity + currentDerivative * (np.array(self.var) - potential)))
+        dcurrent = np.sum(areas * currentDerivative * sensitivity)
+        delta = np.clip((self.current - current) / dcurrent, -self.max_step, self.max_step)
+
+        self.appliedPotential.setValue(float(self.appliedPotential) + delta)
+        self.var.setValue(np.array(self.var) + delta * sensitivity)
+        self.potentialStep = abs(delta)
+        return residual
 
 
 class CupricEquation(SweepEquation):
+    name = 'cupric'
+
     def __init__(self, params, variables):
         cap = variables.cap
         self.equation = fp.TransientTerm() == \
@@ -73,31 +363,247 @@ class CupricEquation(SweepEquation):
         - fp.ImplicitSourceTerm(variables.baseCurrent * variables.surface / \
                                 (params.bulkCupric * params.charge * params.faradaysConstant)) \
         + 1e+5 * params.bulkCupric * cap - fp.ImplicitSourceTerm(1e+5 * cap)
-        self.solver = scipy_solvers.LinearLUSolver()
+        self.solver = get_solver(params, self.name)
         self.var = variables.cupric
 
 
 class SuppressorEquation(SweepEquation):
+    name = 'suppressor'
+
     def __init__(self, params, variables):
         self.equation = fp.TransientTerm() == fp.DiffusionTerm(params.diffusionSuppressor * variables.harmonic) \
           - fp.ImplicitSourceTerm(params.gamma * params.kPlus * (1 - variables.interfaceTheta) * variables.surface)
-        # self.solver = fp.LinearPCGSolver(tolerance=params.solver_tol)
-        self.solver = scipy_solvers.LinearLUSolver()
+        self.solver = get_solver(params, self.name)
         self.var = variables.suppressor
 
 
 class ThetaEquation(SweepEquation):
+    name = 'theta'
+
     def __init__(self, params, variables):
         self.dt = fp.Variable(1.)
         adsorptionCoeff = self.dt * variables.suppressor * params.kPlus
+        ## the kMinus sink has no interface area factor, it relies on
+        ## the deposition rate being zero off the interface
         self.equation = fp.TransientTerm() == fp.ExplicitUpwindConvectionTerm(fp.SurfactantConvectionVariable(variables.distance)) \
           + adsorptionCoeff * variables.surface \
           - fp.ImplicitSourceTerm(adsorptionCoeff * variables.distance._cellInterfaceFlag) \
           - fp.ImplicitSourceTerm(params.kMinus * variables.depositionRate * self.dt)
         self.var = variables.theta
-        # self.solver = fp.LinearPCGSolver(tolerance=params.solver_tol)
-        self.solver = scipy_solvers.LinearLUSolver()
+        self.solver = get_solver(params, self.name)
 
     def sweep(self, dt):
         self.dt.setValue(dt)
         return super(ThetaEquation, self).sweep(dt=1.)
+
+
+def _sink(coeff, x):
+    """Split a sink coefficient like `ImplicitSourceTerm`, implicit
+    where it is positive and explicit elsewhere.
+
+    Returns:
+        the diagonal coefficient and the explicit source
+
+    >>> _sink(np.array([2., -3.]), np.array([5., 7.]))
+    (array([2., 0.]), array([ 0., 21.]))
+    """
+    return np.maximum(coeff, 0.), np.maximum(-coeff, 0.) * x
+
+
+class StencilSweepEquation(SweepEquation):
+    """Sweep with the matrix assembled by `StencilOperator` rather
+    than fipy.
+
+    Subclasses implement `assemble(dt)` to give the matrix and the
+    right hand side vector. The linear solve uses the solver from
+    `get_solver` and the residual is calculated as in fipy's `sweep`.
+    """
+    def sweep(self, dt):
+        L, b = self.assemble(dt)
+        x = np.array(self.var.value, dtype=float)
+        residual = np.sqrt(np.sum((L * x - b)**2))
+        self.var.setValue(self.solver._solve_(L, x, b))
+        return normalize_residual(residual, b)
+
+
+class StencilPotentialEquation(PotentialEquation, StencilSweepEquation):
+    def __init__(self, params, variables):
+        super(StencilPotentialEquation, self).__init__(params, variables)
+        self.variables = variables
+        self.kappa = params.kappa
+        self.transientCoeff = potential_transient_coeff(params, variables)
+        self.operator = StencilOperator(variables.distance.mesh)
+
+    def assemble(self, dt):
+        variables = self.variables
+        x = np.array(self.var)
+        surface = np.array(variables.surface)
+        currentDerivative = np.array(variables.currentDerivative)
+        upper = np.array(self.upper)
+        transient = np.array(self.transientCoeff, dtype=float) / dt
+        diagonal, explicit = _sink(surface * currentDerivative, x)
+        L = self.operator.matrix(self.kappa * np.array(variables.harmonic),
+                                 transient + diagonal + upper)
+        source = transient * np.array(self.var.old) + explicit \
+          - surface * (np.array(variables.currentDensity) - x * currentDerivative) \
+          - upper * float(variables.appliedPotential)
+        return L, source * self.operator.volumes
+
+
+class StencilCupricEquation(CupricEquation, StencilSweepEquation):
+    def __init__(self, params, variables):
+        super(StencilCupricEquation, self).__init__(params, variables)
+        self.variables = variables
+        self.params = params
+        self.operator = StencilOperator(variables.distance.mesh)
+
+    def assemble(self, dt):
+        params = self.params
+        variables = self.variables
+        x = np.array(self.var)
+        cap = 1e+5 * np.array(variables.cap)
+        reaction = np.array(variables.baseCurrent) * np.array(variables.surface) \
+          / (params.bulkCupric * params.charge * params.faradaysConstant)
+        diffusion = params.diffusionCupric * np.array(variables.masked_harmonic)
+        diagonal0, explicit0 = _sink(reaction, x)
+        diagonal1, explicit1 = _sink(cap, x)
+        L = self.operator.matrix(diffusion, 1. / dt + diagonal0 + diagonal1, fixed_top=True)
+        source = np.array(self.var.old) / dt + explicit0 + explicit1 + params.bulkCupric * cap
+        return L, source * self.operator.volumes + self.operator.top(diffusion) * params.bulkCupric
+
+
+class StencilSuppressorEquation(SuppressorEquation, StencilSweepEquation):
+    def __init__(self, params, variables):
+        super(StencilSuppressorEquation, self).__init__(params, variables)
+        self.variables = variables
+        self.params = params
+        self.operator = StencilOperator(variables.distance.mesh)
+
+    def assemble(self, dt):
+        params = self.params
+        variables = self.variables
+        x = np.array(self.var)
+        adsorption = params.gamma * params.kPlus * (1 - np.array(variables.interfaceTheta)) \
+          * np.array(variables.surface)
+        diffusion = params.diffusionSuppressor * np.array(variables.harmonic)
+        diagonal, explicit = _sink(adsorption, x)
+        L = self.operator.matrix(diffusion, 1. / dt + diagonal, fixed_top=True)
+        source = np.array(self.var.old) / dt + explicit
+        return L, source * self.operator.volumes + self.operator.top(diffusion) * params.bulkSuppressor
+
+
+def get_field_equations(params, variables):
+    """Create the potential, cupric, suppressor and theta equations.
+
+    The optional `params.backend` is "fipy" (the default) to assemble
+    the equations with fipy or "stencil" to assemble the potential,
+    cupric and suppressor equations with `StencilOperator`. The theta
+    equation is always assembled with fipy.
+    """
+    backend = getattr(params, 'backend', 'fipy')
+    if backend == 'fipy':
+        classes = (PotentialEquation, CupricEquation, SuppressorEquation)
+    elif backend == 'stencil':
+        classes = (StencilPotentialEquation, StencilCupricEquation, StencilSuppressorEquation)
+    else:
+        raise ValueError("unknown backend {0}".format(backend))
+    return tuple(cls(params, variables) for cls in classes) + (ThetaEquation(params, variables),)
+
+
+class _CouplingTerm(fp.ImplicitSourceTerm):
+    """Implicit source term that stays implicit whatever its sign.
+
+    `ImplicitSourceTerm` only treats coefficients implicitly where they
+    add to the diagonal dominance, which drops Jacobian entries from
+    the off diagonal blocks.
+    """
+    def _getWeight(self, var, transientGeomCoeff=None, diffusionGeomCoeff=None):
+        return {'diagonal' : numerix.ones(var.shape),
+                'old value' : numerix.zeros(var.shape),
+                'b vector' : numerix.zeros(var.shape),
+                'new value' : numerix.zeros(var.shape)}
+
+
+class CoupledEquation(object):
+    """Newton iteration for the fully coupled field equations.
+
+    The potential, cupric, suppressor and theta equations are solved as
+    a single block system. Along with the terms in the segregated
+    equations, the cross derivatives of the reaction terms are treated
+    implicitly so that each sweep is an (inexact) Newton step for the
+    coupled system. The theta equation is divided
+    through by the time step so that all the blocks share the same
+    transient term. The linear solves use a tolerance relative to the
+    initial residual as the blocks are scaled very differently.
+    """
+    name = 'coupled'
+
+    def __init__(self, params, variables):
+        potential = variables.potential
+        cupric = variables.cupric
+        suppressor = variables.suppressor
+        theta = variables.theta
+        distance = variables.distance
+        mesh = distance.mesh
+        surface = variables.surface
+        nF = params.charge * params.faradaysConstant
+
+        upper = fp.CellVariable(mesh=mesh)
+        ID = mesh._getNearestCellID(mesh.faceCenters[:,mesh.facesTop.value])
+        upper[ID] = params.kappa / mesh.dy[-1] / (params.deltaRef - params.delta + mesh.dy[-1])
+
+        ## d(surface * interfaceTheta) / d(theta) on the interface
+        thetaMask = (surface > 0) * (variables.interfaceTheta < 1)
+
+        def coupling(coeff, var):
+            return _CouplingTerm(coeff, var=var) - coeff * var
+
+        dcurrent_dcupric = variables.baseCurrent / params.bulkCupric
+        dcurrent_dtheta = variables.currentThetaDerivative * thetaMask
+        potentialEqn = fp.TransientTerm(potential_transient_coeff(params, variables), var=potential) == \
+          fp.DiffusionTerm(params.kappa * variables.harmonic, var=potential) \
+        - surface * (variables.currentDensity - potential * variables.currentDerivative) \
+        - fp.ImplicitSourceTerm(surface * variables.currentDerivative, var=potential) \
+        - upper * variables.appliedPotential - fp.ImplicitSourceTerm(upper, var=potential) \
+        - coupling(surface * dcurrent_dcupric, cupric) \
+        - coupling(dcurrent_dtheta, theta)
+
+        cap = variables.cap
+        cupricEqn = fp.TransientTerm(var=cupric) == \
+          fp.DiffusionTerm(params.diffusionCupric * variables.masked_harmonic, var=cupric) \
+        - fp.ImplicitSourceTerm(variables.baseCurrent * surface / (params.bulkCupric * nF), var=cupric) \
+        + 1e+5 * params.bulkCupric * cap - fp.ImplicitSourceTerm(1e+5 * cap, var=cupric) \
+        - coupling(surface * variables.currentDerivative / nF, potential) \
+        - coupling(dcurrent_dtheta / nF, theta)
+
+        adsorption = params.gamma * params.kPlus
+        suppressorEqn = fp.TransientTerm(var=suppressor) == \
+          fp.DiffusionTerm(params.diffusionSuppressor * variables.harmonic, var=suppressor) \
+        - fp.ImplicitSourceTerm(adsorption * (1 - variables.interfaceTheta) * surface, var=suppressor) \
+        + coupling(adsorption * suppressor * thetaMask, theta)
+
+        self.dt = fp.Variable(1.)
+        interfaceFlag = distance._cellInterfaceFlag
+        convection = fp.SurfactantConvectionVariable(distance) / self.dt
+        ddeposition = params.kMinus * theta * params.omega / nF
+        thetaEqn = fp.TransientTerm(var=theta) == \
+          fp.ExplicitUpwindConvectionTerm(convection, var=theta) \
+        + params.kPlus * suppressor * surface \
+        - fp.ImplicitSourceTerm(params.kPlus * suppressor * interfaceFlag, var=theta) \
+        - fp.ImplicitSourceTerm(params.kMinus * variables.depositionRate, var=theta) \
+        + coupling(params.kPlus * (surface - interfaceFlag * theta), suppressor) \
+        - coupling(ddeposition * variables.currentDerivative, potential) \
+        - coupling(ddeposition * dcurrent_dcupric, cupric) \
+        - coupling(params.kMinus * variables.interfaceTheta * params.omega / nF * dcurrent_dtheta, theta)
+
+        self.equation = potentialEqn & cupricEqn & suppressorEqn & thetaEqn
+        self.vars = (potential, cupric, suppressor, theta)
+        self.solver = get_solver(params, self.name, criterion='initial')
+
+    def sweep(self, dt):
+        self.dt.setValue(dt)
+        self.equation.sweep(dt=dt, solver=self.solver, cacheResidual=True)
+        residuals = np.split(np.array(self.equation.residualVector), len(self.vars))
+        RHSvectors = np.split(np.array(self.solver.RHSvector), len(self.vars))
+        return OrderedDict([[var.name, normalize_residual(np.sqrt(np.sum(residual**2)), RHSvector)]
+                            for var, residual, RHSvector in zip(self.vars, residuals, RHSvectors)])
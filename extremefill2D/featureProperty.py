@@ -3,6 +3,8 @@ import tables
 import fipy as fp
 import numpy as np
 from scipy.interpolate import interp1d
+from .meshes import record_grid, record_grid_key
+from .tools import voids_from_array
 
 
 def find_all_zeros(f, x0, x1, N=1000):
@@ -18,7 +20,7 @@ class FeatureProperty(object):
     def __init__(self, record):
         self.record = record
         datafile = os.path.join(self.record.datastore.root, self.record.output_data[0].path)
-        self.h5file = tables.openFile(datafile, mode='r')
+        self.h5file = tables.open_file(datafile, mode='r')
 
     def __del__(self):
         self.close()
@@ -26,6 +28,21 @@ class FeatureProperty(object):
     def close(self):
         self.h5file.close()
 
+    def _getMesh(self, data):
+        origin = data.origin.read() if 'origin' in data else None
+        args = (data.nx.read(), data.ny.read(), data.dx.read(), data.dy.read())
+        key = record_grid_key(*args, origin=origin)
+        if key != getattr(self, 'meshKey', None):
+            self.meshKey = key
+            self.mesh = record_grid(*args, origin=origin, featureDepth=self.record.parameters['featureDepth'])
+            self.nearestCellIDs = {}
+        return self.mesh
+
+    def _getNearestCellIDs(self, name, points):
+        if name not in self.nearestCellIDs:
+            self.nearestCellIDs[name] = self.mesh._getNearestCellID(points)
+        return self.nearestCellIDs[name]
+
     def getLatestIndex(self):
         return self.h5file.root._v_attrs.latestIndex
 
@@ -33,14 +50,10 @@ class FeatureProperty(object):
         if not index:
             index = self.getLatestIndex()
 
-        data = self.h5file.getNode('/ID' + str(int(index)))
+        data = self.h5file.get_node('/ID' + str(int(index)))
 
-        mindx = min(data.dx.read())
         featureDepth = self.record.parameters['featureDepth']
-        distanceBelowTrench = 10 * mindx
-
-        if not hasattr(self, 'mesh'):
-            self.mesh = fp.Grid2D(nx=data.nx.read(), ny=data.ny.read(), dx=data.dx.read(), dy=data.dy.read()) - [[-mindx / 100.], [distanceBelowTrench + featureDepth]]
+        self._getMesh(data)
         phi = fp.CellVariable(mesh=self.mesh, value=data.distance.read())
 
         N = 1000
@@ -49,9 +62,7 @@ class FeatureProperty(object):
         X = (rinner + router) / 2. * np.ones(N)
         Y = np.linspace(-featureDepth, 10e-6, 1000)
         points = (X, Y)
-        if not hasattr(self, 'nearestCellIDs'):
-            self.nearestCellIDs = self.mesh._getNearestCellID(points)
-        phiInterpolated = phi(points, order=1, nearestCellIDs=self.nearestCellIDs)
+        phiInterpolated = phi(points, order=1, nearestCellIDs=self._getNearestCellIDs('zeros', points))
 
         f = interp1d(Y, phiInterpolated)
         zeros = find_all_zeros(f, Y[0], Y[-1])
@@ -80,23 +91,32 @@ class FeatureProperty(object):
             height = min(height, 1.)
         return height
 
+    def getVoids(self, index=None):
+        if index is None:
+            index = self.getLatestIndex()
+        data = self.h5file.get_node('/ID' + str(int(index)))
+        if 'voids' not in data:
+            return None
+        return voids_from_array(data.voids.read())
+
+    def getVoidVolume(self, index=None):
+        voids = self.getVoids(index)
+        if voids is None:
+            return None
+        return sum(void['volume'] for void in voids)
+
     def getTime(self, index=None):
         if index is None:
             index = self.getLatestIndex()
-        data = self.h5file.getNode('/ID' + str(int(index)))
+        data = self.h5file.get_node('/ID' + str(int(index)))
         return float(data.elapsedTime.read())
 
     def getPotential(self, index=None):
         if not index:
             index = self.getLatestIndex()
-        data = self.h5file.getNode('/ID' + str(int(index)))
-
-        mindx = min(data.dx.read())
-        featureDepth = self.record.parameters['featureDepth']
-        distanceBelowTrench = 10 * mindx
+        data = self.h5file.get_node('/ID' + str(int(index)))
 
-        if not hasattr(self, 'mesh'):
-            self.mesh = fp.Grid2D(nx=data.nx.read(), ny=data.ny.read(), dx=data.dx.read(), dy=data.dy.read()) - [[-mindx / 100.], [distanceBelowTrench + featureDepth]]
+        self._getMesh(data)
         potential = fp.CellVariable(mesh=self.mesh, value=data.potential.read())
 
         rinner = self.record.parameters['rinner']
@@ -104,23 +124,20 @@ class FeatureProperty(object):
         X = (rinner + router) / 2.
         Y = 0.0
         point = ((X,), (Y,))
-        if not hasattr(self, 'nearestCellIDsPotential'):
-            self.nearestCellIDsPotential = self.mesh._getNearestCellID(point)
-        monitorValue = potential(point, order=1, nearestCellIDs=self.nearestCellIDsPotential)
+        monitorValue = potential(point, order=1, nearestCellIDs=self._getNearestCellIDs('potential', point))
 
         return float(monitorValue[0])
 
     def getTheta(self, index=None):
         if not index:
             index = self.getLatestIndex()
-        data = self.h5file.getNode('/ID' + str(int(index)))
+        data = self.h5file.get_node('/ID' + str(int(index)))
 
         mindx = min(data.dx.read())
         featureDepth = self.record.parameters['featureDepth']
         distanceBelowTrench = 10 * mindx
 
-        if not hasattr(self, 'mesh'):
-            self.mesh = fp.Grid2D(nx=data.nx.read(), ny=data.ny.read(), dx=data.dx.read(), dy=data.dy.read()) - [[-mindx / 100.], [distanceBelowTrench + featureDepth]]
+        self._getMesh(data)
         theta = fp.CellVariable(mesh=self.mesh, value=data.interfaceTheta.read())
 
         rinner = self.record.parameters['rinner']
@@ -129,7 +146,5 @@ class FeatureProperty(object):
         X = np.ones(N) * (rinner + router) / 2.
         Y = np.linspace(-distanceBelowTrench - featureDepth, featureDepth / 5., N)
         points = (X, Y)
-        if not hasattr(self, 'nearestCellIDsTheta'):
-            self.nearestCellIDsTheta = self.mesh._getNearestCellID(points)
-        values = theta(points, order=0, nearestCellIDs=self.nearestCellIDsTheta)
+        values = theta(points, order=0, nearestCellIDs=self._getNearestCellIDs('theta', points))
         return float(max(values))
@@ -8,15 +8,16 @@ from toolz.curried import curry  # pylint: disable=no-name-in-module
 import numpy as np
 import fipy as fp
 
-from ..meshes import ExtremeFill2DMesh
+from ..meshes import get_mesh
 from ..variables import Variables
-from ..equations import AdvectionEquation
-from ..equations import PotentialEquation, CupricEquation
-from ..equations import SuppressorEquation, ThetaEquation
+from ..equations import get_advection_equation
+from ..equations import get_field_equations
+from ..equations import converge_sweeps as converge
+from ..profiling import NullProfiler
 
 
 @curry
-def run(params, total_steps, logger=None, input_values=None):
+def run(params, total_steps, logger=None, input_values=None, profiler=None):
     """Run an ExtremeFill2D simulation
 
     Args:
@@ -25,12 +26,18 @@ def run(params, total_steps, logger=None, input_values=None):
       total_steps: the total number of steps to run the simulation
       logger: a logger to log output details
       input_values: the start values for the parameters
+      profiler: a `Profiler` to record the time in each phase of
+        the steps, the report is passed to the logger, or printed if
+        there is no logger, at the end of the run
 
     Returns:
       the value of the variables after running the simulation
 
     """
-    mesh = ExtremeFill2DMesh(params)
+    if profiler is None:
+        profiler = NullProfiler()
+
+    mesh = get_mesh(params)
 
     variables = Variables(params, mesh)
     if input_values is not None:
@@ -46,42 +53,63 @@ def run(params, total_steps, logger=None, input_values=None):
         time_step_duration = params.dt
 
     equations = get_equations(params, variables)
-    advection = AdvectionEquation(params, variables)
+    advection = get_advection_equation(params, variables)
 
     redo_timestep = False
     step = 0
-    extension_global = max(variables.extension.globalValue)
+    extension_global = None
+    profiler.start()
 
     while step < total_steps:
 
         distance_old = update_old(variables.distance, equations)
+        extension_count = 0
 
-        if step > 0 and extension_global < params.shutdown_deposition_rate:
+        if step > 0 and extension_global is not None \
+           and extension_global < params.shutdown_deposition_rate:
             break
 
         if step % int(params.levelset_update_ncell / params.CFL) == 0:
-            variables.distance.deleteIslands()
-            variables.distance.calcDistanceFunction(order=1)
+            with profiler.phase('islands'):
+                variables.distance.deleteIslands()
+            with profiler.phase('reinitialization'):
+                extension_global = extend(variables.extension,
+                                          variables.depositionRate,
+                                          variables.distance,
+                                          reinitialize=True)
+            extension_count += 1
+
+        if extension_global is None:
+            with profiler.phase('extension'):
+                extension_global = extend(variables.extension,
+                                          variables.depositionRate,
+                                          variables.distance)
+            extension_count += 1
 
         time_step_duration = update_dt(time_step_duration,
                                        params,
                                        mesh,
-                                       variables)
+                                       extension_global)
+
+        with profiler.phase('advection'):
+            advection.solve(time_step_duration)
 
-        advection.solve(time_step_duration)
+        residuals = converge_sweeps(time_step_duration, equations, params, profiler)
 
-        residuals = [sweep(time_step_duration, equations)
-                     for _ in range(params.sweeps)]
+        with profiler.phase('extension'):
+            extension_global = extend(variables.extension,
+                                      variables.depositionRate,
+                                      variables.distance)
+        extension_count += 1
 
-        extension_global = extend(variables.extension,
-                                  variables.depositionRate,
-                                  variables.distance)
+        profiled_step = step
 
         if time_step_duration > (params.CFL * mesh.nominal_dx / extension_global * 1.1):
             time_step_duration = revert_step(time_step_duration,
                                              equations,
                                              variables.distance,
                                              distance_old)
+            extension_global = None
             if redo_timestep:
                 break
             else:
@@ -92,8 +120,18 @@ def run(params, total_steps, logger=None, input_values=None):
             step += 1
             redo_timestep = False
 
+        profiler.end_step(profiled_step)
+
+        if logger is not None:
+            logger.log(step, elapsed_time, time_step_duration, redo_timestep, residuals,
+                       extensions=extension_count)
+
+    profiler.close()
+    if profiler.enabled:
         if logger is not None:
-            logger.log(step, elapsed_time, time_step_duration, redo_timestep, residuals)
+            logger.log_report(profiler.report())
+        else:
+            print(profiler.report())
 
     return dict(distance=np.array(variables.distance),
                 cupric=np.array(variables.cupric),
@@ -112,36 +150,48 @@ def update_old(distance, equations):
     """
     for eqn in equations:
         eqn.var.updateOld()
+        eqn.newStep()
     return fp.numerix.array(distance).copy()
 
 def get_equations(params, variables):
     """Create the equations
     """
-    return (PotentialEquation(params, variables),
-            CupricEquation(params, variables),
-            SuppressorEquation(params, variables),
-            ThetaEquation(params, variables))
+    return get_field_equations(params, variables)
 
-def update_dt(time_step_duration, params, mesh, variables):
-    """Update the time step
+def update_dt(time_step_duration, params, mesh, extension_global):
+    """Update the time step using the maximum extension velocity
     """
-    extension_global = extend(variables.extension, variables.depositionRate, variables.distance)
     time_step_duration = min(float(params.CFL * mesh.nominal_dx / extension_global),
                              time_step_duration * 1.1)
     time_step_duration = min(time_step_duration, params.dtMax)
     return max(time_step_duration, params.dtMin)
 
-def extend(extension, deposition_rate, distance):
-    """Calculate the extension velocity
+def extend(extension, deposition_rate, distance, reinitialize=False):
+    """Calculate the extension velocity, reinitializing the distance
+    in the same pass if required
     """
     extension[:] = deposition_rate
-    distance.extendVariable(extension)
+    if reinitialize:
+        distance.reinitializeAndExtend(extension, order=1)
+    else:
+        distance.extendVariable(extension)
     return max(extension.globalValue)
 
-def sweep(time_step_duration, equations):
+def sweep(time_step_duration, equations, profiler=NullProfiler()):
     """Sweep the equations
     """
-    OrderedDict([[eqn.var.name, eqn.sweep(time_step_duration)] for eqn in equations])
+    residuals = OrderedDict()
+    for eqn in equations:
+        with profiler.phase(eqn.name):
+            residuals[eqn.var.name] = eqn.sweep(time_step_duration)
+    return residuals
+
+def converge_sweeps(time_step_duration, equations, params, profiler=NullProfiler()):
+    """Sweep the equations until converged or `params.sweeps` is reached
+    """
+    return converge(lambda: sweep(time_step_duration, equations, profiler),
+                    [(eqn.name, eqn.var.name) for eqn in equations],
+                    params)
 
 def revert_step(time_step_duration, equations, distance, distance_old):
     """Revert the time step.
@@ -149,5 +199,6 @@ def revert_step(time_step_duration, equations, distance, distance_old):
     time_step_duration = time_step_duration * 0.1
     for eqn in equations:
         eqn.var[:] = eqn.var.old
+        eqn.newStep()
     distance[:] = distance_old
     return time_step_duration
@@ -0,0 +1,149 @@
+import json
+import time
+
+
+class StepLogger(object):
+    """Throttled logger for the time steps of a simulation.
+
+    Implements the `log(step, elapsed_time, dt, redo, residuals,
+    extensions=None)` and `log_report(report)` protocol used by
+    `ExtremeFillSystem.run` and `fextreme.run`. A
+    record is taken every `every_steps` steps or every `every_seconds`
+    seconds of wall time, whichever comes first, and always for a
+    repeated step or when the step number goes back at the start of a
+    new run. Each record is written to `filename` as a line of
+    JSON with the residuals of the final sweep, the number of sweeps
+    and the number of extension velocity calculations. Nothing is printed unless `summary` is called.
+
+    Attributes:
+        record: the latest record
+        count: the number of records taken
+        report: the profiling report for the end of the run or None
+
+    >>> logger = StepLogger(every_steps=2)
+    >>> for step in range(1, 5):
+    ...     logger.log(step, 0.1 * step, 0.1, False, [dict(psi=1e-3), dict(psi=1e-9)], extensions=1)
+    >>> logger.count, logger.record['step'], logger.record['sweeps']
+    (2, 3, 2)
+    >>> print(logger.summary())
+    step 3, elapsed time 3.0000e-01, dt 1.0000e-01, redo False, sweeps 2, extensions 1
+      psi 1.0000e-09
+    """
+    def __init__(self, filename=None, every_steps=1, every_seconds=None):
+        """Init for StepLogger.
+
+        Args:
+            filename: the file to write the records to or None to only
+                keep the latest record
+            every_steps: the number of steps between records or None
+            every_seconds: the wall time between records or None
+
+        """
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.stream = open(filename, 'w') if filename is not None else None
+        self.record = None
+        self.report = None
+        self.count = 0
+        self._last_step = None
+        self._last_time = time.time()
+
+    def _due(self, step, redo):
+        if redo or self._last_step is None or step < self._last_step:
+            return True
+        if self.every_steps is not None and step - self._last_step >= self.every_steps:
+            return True
+        return self.every_seconds is not None and time.time() - self._last_time >= self.every_seconds
+
+    def log(self, step, elapsed_time, dt, redo, residuals, extensions=None):
+        """Take a record of the step if one is due.
+
+        Args:
+            step: the step number
+            elapsed_time: the simulation time
+            dt: the time step
+            redo: whether the step is to be repeated
+            residuals: a list with the residuals of each sweep
+            extensions: the number of extension velocity calculations
+                in the step or None
+
+        """
+        if not self._due(step, redo):
+            return
+        self._last_step = step
+        self._last_time = time.time()
+        self.count += 1
+        self.record = dict(step=int(step),
+                           elapsed_time=float(elapsed_time),
+                           dt=float(dt),
+                           redo=bool(redo),
+                           sweeps=len(residuals),
+                           extensions=None if extensions is None else int(extensions),
+                           residuals=dict((k, float(v)) for k, v in residuals[-1].items()))
+        if self.stream is not None:
+            self.stream.write(json.dumps(self.record, sort_keys=True) + '\n')
+            self.stream.flush()
+
+    def log_report(self, report):
+        """Record the profiling report at the end of a run.
+
+        The report is written to the file as a line of JSON with a
+        "report" key.
+
+        Args:
+            report: the report from `Profiler.report`
+
+        """
+        self.report = report
+        if self.stream is not None:
+            self.stream.write(json.dumps(dict(report=report)) + '\n')
+            self.stream.flush()
+
+    def summary(self):
+        """Human readable summary of the latest record.
+
+        Returns:
+            the summary as a string
+
+        """
+        if self.record is None:
+            return 'no steps logged'
+        record = self.record
+        line = 'step {step}, elapsed time {elapsed_time:.4e}, dt {dt:.4e}, redo {redo}, sweeps {sweeps}'.format(**record)
+        if record['extensions'] is not None:
+            line += ', extensions {extensions}'.format(**record)
+        lines = [line]
+        for k in sorted(record['residuals']):
+            lines.append('  {0} {1:.4e}'.format(k, record['residuals'][k]))
+        return '\n'.join(lines)
+
+    def close(self):
+        """Close the log file.
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def get_logger(params):
+    """Create the logger given by the optional `params.log_file`.
+
+    The records are throttled with `params.log_every_steps` (default
+    1) and `params.log_every_seconds` (default None).
+
+    Args:
+        params: the parameters
+
+    Returns:
+        a `StepLogger` or None if `params.log_file` is not set
+
+    >>> from collections import namedtuple
+    >>> get_logger(namedtuple('Params', [])()) is None
+    True
+    """
+    filename = getattr(params, 'log_file', None)
+    if filename is None:
+        return None
+    return StepLogger(filename=filename,
+                      every_steps=getattr(params, 'log_every_steps', 1),
+                      every_seconds=getattr(params, 'log_every_seconds', None))
@@ -1,6 +1,17 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
 import numpy as np
+from scipy.interpolate import RegularGridInterpolator
 
 
+import fipy as fp
+from fipy.tools import parallelComm
+from fipy.tools.dimensions.physicalField import PhysicalField
 from fipy.meshes.cylindricalNonUniformGrid2D import CylindricalNonUniformGrid2D
 
 
@@ -13,16 +24,28 @@ class ExtremeFill2DMesh(CylindricalNonUniformGrid2D):
     The grid is coarsened away from the feature using a geometric
     ratio.
     
+    The fine region in the vertical direction can start above the
+    bottom of the feature so that the part of the feature that has
+    already filled is coarsened. The fine cells keep the same
+    positions whatever the fill height.
+
     Attributes:
         nominal_dx: The ideal value for dx. Not the actual value of dx
+        coarse_height: The height above the bottom of the feature where
+            the fine region starts, a whole number of nominal_dx
+        max_coarse_height: The largest possible coarse_height
         
     """
-    def __init__(self, params):
+    def __init__(self, params, coarse_height=0., truncate=False):
         """Init for ExtremeFill2DMesh.
 
         Args: 
             params: a class with Nx, rinner, router, rboundary,
                 spacing_ratio, featureDepth and delta attributes.
+            coarse_height: the height above the bottom of the feature
+                below which the grid is coarsened
+            truncate: remove the coarse cells below `coarse_height`
+                rather than keep them
 
         """
 
@@ -30,22 +53,89 @@ class ExtremeFill2DMesh(CylindricalNonUniformGrid2D):
         dx = dy
         distanceBelowTrench = 10 * dx
         padding = 3 * dx
+        self.max_coarse_height = params.featureDepth - padding
+        coarse_height = int(np.clip(coarse_height, 0., self.max_coarse_height) / dy) * dy
 
         dx_nonuniform = self.get_nonuniform_dx(dx, params.rinner,
                                                params.router,
                                                params.rboundary, padding,
                                                params.spacing_ratio)
         
-        dy_nonuniform = self.get_nonuniform_dx(dy, distanceBelowTrench,
+        ## shift the start of the fine region down by a fraction of a
+        ## cell so that it holds a whole number of cells in spite of
+        ## round off
+        shift = 1e-9 * dy if coarse_height > 0 else 0.
+        dy_nonuniform = self.get_nonuniform_dx(dy, distanceBelowTrench + coarse_height - shift,
                                                distanceBelowTrench + params.featureDepth,
                                                distanceBelowTrench + params.featureDepth + params.delta,
                                                padding,
                                                params.spacing_ratio)
 
         origin = -np.array([[-dx / 100.], [distanceBelowTrench + params.featureDepth]])
+
+        if truncate:
+            edges = np.cumsum(dy_nonuniform)
+            ncoarse = np.searchsorted(edges, distanceBelowTrench + coarse_height - padding + 1e-6 * dy, side='right')
+            if ncoarse > 0:
+                origin = origin + [[0.], [edges[ncoarse - 1]]]
+                dy_nonuniform = dy_nonuniform[ncoarse:]
         super(ExtremeFill2DMesh, self).__init__(dx=dx_nonuniform, dy=dy_nonuniform, origin=origin)
         #self = self - [[-dx / 100.], [distanceBelowTrench + params.featureDepth]]
         self.nominal_dx = dx
+        self.coarse_height = coarse_height
+
+    def remap(self, value, mesh):
+        """Conservatively transfer a cell value from another mesh.
+
+        The other mesh must have the same spacing in the horizontal
+        direction and cover this mesh. The value in each cell is the
+        average over the cell of the piecewise constant value on the
+        other mesh so the integral of the value is conserved.
+
+        Args:
+            value: the cell values on the other mesh
+            mesh: the other mesh
+
+        Returns:
+            an array of the cell values on this mesh
+
+        """
+        nx, ny = self.shape
+        other_ny = mesh.shape[1]
+        edges = np.cumsum(np.concatenate(([self.bottom], self.dy)))
+        other_edges = np.cumsum(np.concatenate(([mesh.bottom], mesh.dy)))
+        overlap = np.minimum(edges[1:, None], other_edges[None, 1:]) \
+                  - np.maximum(edges[:-1, None], other_edges[None, :-1])
+        weights = np.maximum(overlap, 0.) / np.diff(edges)[:, None]
+        return np.dot(weights, np.reshape(value, (other_ny, nx))).flatten()
+
+    def interpolate(self, value, mesh):
+        """Linearly interpolate a cell value from another mesh.
+
+        The other mesh can have any resolution. The value is held
+        constant beyond the outermost cell centers of the other mesh.
+
+        Args:
+            value: the cell values on the other mesh
+            mesh: the other mesh
+
+        Returns:
+            an array of the cell values on this mesh
+
+        """
+        other_nx, other_ny = mesh.shape
+        x = np.array(mesh.x[:other_nx])
+        y = np.array(mesh.y[::other_nx])
+        interpolator = RegularGridInterpolator((y, x), np.reshape(value, (other_ny, other_nx)))
+        points = np.array([np.clip(self.y, y[0], y[-1]),
+                           np.clip(self.x, x[0], x[-1])]).T
+        return interpolator(points)
+
+    @property
+    def bottom(self):
+        """The position of the bottom of the mesh.
+        """
+        return float(self.y[0] - self.dy[0] / 2.)
 
     def get_nonuniform_dx(self, dx, x0, x1, x2, padding, spacing_ratio=1.1):
         """Calculates mesh spacing for a triple layered domain.
@@ -105,3 +195,232 @@ class ExtremeFill2DMesh(CylindricalNonUniformGrid2D):
         if len(spacing) > 0:
             spacing[-1] = spacing[-1] + (L - Lestimate)
         return spacing
+
+
+def record_grid(nx, ny, dx, dy, origin=None, featureDepth=None):
+    """The grid for the values in a record written by `DataWriter`.
+
+    The grid has the spacing of the simulation mesh and starts at the
+    origin stored with the record. Records written without an origin
+    are from meshes starting at the bottom of a full
+    `ExtremeFill2DMesh`, 10 cells below a feature of depth
+    `featureDepth`.
+
+    Args:
+        nx: the number of cells in the horizontal direction
+        ny: the number of cells in the vertical direction
+        dx: the horizontal spacing
+        dy: the vertical spacing
+        origin: the (x, y) position of the lower left corner or None
+        featureDepth: the depth of the feature for records without
+            an origin
+
+    Returns:
+        a fipy grid
+
+    >>> grid = record_grid(2, 3, [1e-6] * 2, [1e-6] * 3, origin=(1e-8, -5e-6))
+    >>> print(round(float(grid.y[0]), 12))
+    -4.5e-06
+    >>> grid = record_grid(2, 3, [1e-6] * 2, [1e-6] * 3, featureDepth=5e-6)
+    >>> print(round(float(grid.y[0]), 12))
+    -1.45e-05
+    """
+    if origin is None:
+        mindx = min(dx)
+        origin = (mindx / 100., -(10 * mindx + featureDepth))
+    return fp.Grid2D(nx=nx, ny=ny, dx=dx, dy=dy) + [[origin[0]], [origin[1]]]
+
+
+def record_grid_key(nx, ny, dx, dy, origin=None):
+    """The values that determine the grid built by `record_grid`.
+
+    Readers keep the grid for a record and rebuild it when the key of
+    a later record differs, which happens after the simulation
+    remeshes.
+
+    Args:
+        nx: the number of cells in the horizontal direction
+        ny: the number of cells in the vertical direction
+        dx: the horizontal spacing
+        dy: the vertical spacing
+        origin: the (x, y) position of the lower left corner or None
+
+    Returns:
+        a hashable key
+
+    >>> key = record_grid_key(2, 3, [1e-6] * 2, [1e-6] * 3)
+    >>> key == record_grid_key(2, 3, [1e-6] * 2, [1e-6] * 3)
+    True
+    >>> key == record_grid_key(2, 2, [1e-6] * 2, [1e-6] * 2)
+    False
+    """
+    if origin is not None:
+        origin = tuple(np.atleast_1d(origin).astype(float))
+    return (int(nx), int(ny),
+            tuple(np.atleast_1d(dx).astype(float)),
+            tuple(np.atleast_1d(dy).astype(float)),
+            origin)
+
+
+## bump whenever a change to this module changes the meshes or the
+## layout of the cache entries
+MESH_CACHE_VERSION = 2
+
+GEOMETRY_KEYS = ('Nx', 'rinner', 'router', 'rboundary', 'featureDepth', 'delta', 'spacing_ratio')
+
+
+def mesh_key(params, coarse_height=0., truncate=False):
+    """Hash of the parameters that determine an `ExtremeFill2DMesh`.
+
+    The hash includes the fipy version and `MESH_CACHE_VERSION` so
+    that entries written by older code are not used.
+
+    Args:
+        params: the parameters
+        coarse_height: the height below which the grid is coarsened
+        truncate: whether the coarse cells are removed
+
+    Returns:
+        the hash as a hex string
+
+    >>> from collections import namedtuple
+    >>> Params = namedtuple('Params', GEOMETRY_KEYS + ('dt',))
+    >>> params = Params(100, 3.1e-6, 8.5e-6, 50e-6, 56e-6, 150e-6, 1.1, 0.01)
+    >>> mesh_key(params) == mesh_key(params._replace(dt=1.))
+    True
+    >>> mesh_key(params) == mesh_key(params._replace(Nx=200))
+    False
+    """
+    values = [getattr(params, k) for k in GEOMETRY_KEYS]
+    values += [float(coarse_height), bool(truncate), fp.__version__, MESH_CACHE_VERSION]
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+def _classes():
+    """The classes that can be restored from a mesh cache entry.
+    """
+    from fipy.meshes.representations.gridRepresentation import _Grid2DRepresentation
+    from fipy.meshes.topologies.gridTopology import _Grid2DTopology
+    classes = (fp.CellVariable, fp.FaceVariable, _Grid2DRepresentation, _Grid2DTopology)
+    return dict((cls.__name__, cls) for cls in classes)
+
+
+def _encode(value, name, mesh, path):
+    """Describe an attribute of a mesh as JSON, writing its arrays to
+    `.npy` files named after `name`.
+    """
+    if isinstance(value, fp.Variable):
+        np.save(os.path.join(path, name + '.npy'), np.array(value.value))
+        return ['variable', value.__class__.__name__]
+    elif isinstance(value, PhysicalField):
+        np.save(os.path.join(path, name + '.npy'), np.array(value.value))
+        return ['physical', None]
+    elif isinstance(value, np.ma.MaskedArray):
+        np.save(os.path.join(path, name + '.npy'), np.ma.getdata(value))
+        has_mask = value.mask is not np.ma.nomask
+        if has_mask:
+            np.save(os.path.join(path, name + '.mask.npy'), value.mask)
+        return ['masked', has_mask]
+    elif type(value) is np.ndarray:
+        np.save(os.path.join(path, name + '.npy'), value)
+        return ['array', None]
+    elif isinstance(value, tuple):
+        return ['tuple', [_encode(v, '{0}.{1}'.format(name, i), mesh, path) for i, v in enumerate(value)]]
+    elif isinstance(value, dict):
+        return ['dict', dict((k, _encode(v, '{0}.{1}'.format(name, k), mesh, path)) for k, v in value.items())]
+    elif isinstance(value, np.generic):
+        return ['value', value.item()]
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return ['value', value]
+    elif getattr(value, '__dict__', None) == dict(mesh=mesh) and value.__class__.__name__ in _classes():
+        return ['mesh', value.__class__.__name__]
+    raise TypeError('cannot cache the mesh attribute {0} of type {1}'.format(name, type(value)))
+
+
+def _decode(item, name, mesh, path):
+    """Restore an attribute described by `_encode`. The arrays are
+    memory mapped read only and viewed as plain arrays as fipy does not
+    accept `np.memmap`.
+    """
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='r').view(np.ndarray)
+
+    kind, value = item
+    if kind == 'variable':
+        return _classes()[value](mesh=mesh, value=load(name))
+    elif kind == 'physical':
+        return PhysicalField(np.array(load(name)))
+    elif kind == 'masked':
+        return np.ma.array(load(name), mask=load(name + '.mask') if value else np.ma.nomask, copy=False)
+    elif kind == 'array':
+        return load(name)
+    elif kind == 'tuple':
+        return tuple(_decode(v, '{0}.{1}'.format(name, i), mesh, path) for i, v in enumerate(value))
+    elif kind == 'dict':
+        return dict((k, _decode(v, '{0}.{1}'.format(name, k), mesh, path)) for k, v in value.items())
+    elif kind == 'mesh':
+        return _classes()[value](mesh)
+    return value
+
+
+def _save_mesh(mesh, path):
+    """Write the attributes of a mesh to a directory.
+
+    Arrays, masked arrays and the values of variables are written as
+    `.npy` files. The rest of the attributes are plain values or
+    objects that only hold the mesh, such as the topology and
+    representation, and are described in `state.json`. Nothing is
+    pickled, so loading an entry cannot execute code.
+    """
+    state = dict((name, _encode(value, name, mesh, path))
+                 for name, value in mesh.__dict__.items() if name != 'communicator')
+    with open(os.path.join(path, 'state.json'), 'w') as ff:
+        json.dump(state, ff)
+
+
+def _load_mesh(path):
+    """Read a mesh written by `_save_mesh`.
+    """
+    with open(os.path.join(path, 'state.json')) as ff:
+        state = json.load(ff)
+    mesh = ExtremeFill2DMesh.__new__(ExtremeFill2DMesh)
+    mesh.communicator = parallelComm
+    for name, item in state.items():
+        setattr(mesh, name, _decode(item, name, mesh, path))
+    return mesh
+
+
+def get_mesh(params, coarse_height=0., truncate=False):
+    """Create an `ExtremeFill2DMesh` using the optional on-disk cache.
+
+    If `params.mesh_cache` is set to a directory, the mesh is loaded
+    from the entry for its `mesh_key`. The entry is created on the
+    first use. Loading memory maps the geometry and topology arrays,
+    so there is no need to rebuild the face and cell connectivity.
+
+    Args:
+        params: the parameters
+        coarse_height: the height below which the grid is coarsened
+        truncate: whether the coarse cells are removed
+
+    Returns:
+        the mesh
+
+    """
+    cache = getattr(params, 'mesh_cache', None)
+    if cache is None:
+        return ExtremeFill2DMesh(params, coarse_height=coarse_height, truncate=truncate)
+    path = os.path.join(cache, mesh_key(params, coarse_height, truncate))
+    if not os.path.exists(path):
+        mesh = ExtremeFill2DMesh(params, coarse_height=coarse_height, truncate=truncate)
+        if not os.path.exists(cache):
+            os.makedirs(cache)
+        tmp = tempfile.mkdtemp(dir=cache)
+        _save_mesh(mesh, tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            ## written by another process in the meantime
+            shutil.rmtree(tmp)
+    return _load_mesh(path)
+
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class FillMonitor(object):
+    """Monitor the fill height and voids of a feature during a run.
+
+    The level set is interpolated onto the vertical line through the
+    middle of the feature, x = (rinner + router) / 2, between the
+    bottom of the feature and 10 microns above the top, and the zeros
+    along the line give the fill height and the void size in the same
+    way as `FeatureProperty.getHeight` and
+    `FeatureProperty.getVoidSize`. The line starts one cell below the
+    bottom of the feature so that the initial interface is found. Only
+    the two columns of cells either side of the line are read so the
+    check is cheap enough to do in the time step loop. The voids found
+    away from the line are read from the `voids` that
+    `deleteIslands` records on the level set.
+
+    Attributes:
+        height: the fill height as a fraction of the feature depth
+        void_size: the largest void along the line as a fraction of
+            the feature depth
+        void_volume: the total volume of the voids found by
+            `deleteIslands`
+        reason: the reason to stop the run or None
+
+    """
+    def __init__(self, params, distance):
+        """Init for FillMonitor.
+
+        Args:
+            params: a class with rinner, router and featureDepth
+                attributes and the optional fill_height (default 1)
+                and stop_on_void (default True) attributes
+            distance: the level set variable
+
+        """
+        mesh = distance.mesh
+        self.distance = distance
+        self.featureDepth = params.featureDepth
+        self.fill_height = getattr(params, 'fill_height', 1.)
+        self.stop_on_void = getattr(params, 'stop_on_void', True)
+
+        nx, ny = mesh.shape
+        x = np.array(mesh.x).reshape((ny, nx))[0]
+        y = np.array(mesh.y).reshape((ny, nx))[:, 0]
+        X = (params.rinner + params.router) / 2.
+        ix = min(max(np.searchsorted(x, X) - 1, 0), nx - 2)
+        self.weight = np.clip((X - x[ix]) / (x[ix + 1] - x[ix]), 0., 1.)
+        self.columns = (ix, ix + 1)
+        rows = np.nonzero((y >= -self.featureDepth) & (y <= 10e-6))[0]
+        self.rows = np.arange(max(rows[0] - 1, 0), rows[-1] + 1)
+        self.Y = y[self.rows]
+        self.shape = (ny, nx)
+
+        self.height = 0.
+        self.void_size = 0.
+        self.void_volume = 0.
+        self.reason = None
+
+    def getZeros(self):
+        """The zeros of the level set along the line.
+
+        A sample that is exactly zero is taken to be on the positive
+        side so that a crossing through it is only counted once.
+
+        Returns:
+            an array of the zeros in ascending order
+
+        """
+        phi = np.array(self.distance).reshape(self.shape)[self.rows]
+        phi = (1 - self.weight) * phi[:, self.columns[0]] + self.weight * phi[:, self.columns[1]]
+        positive = phi >= 0
+        index = np.nonzero(positive[1:] != positive[:-1])[0]
+        phi0, phi1 = phi[index], phi[index + 1]
+        Y0, Y1 = self.Y[index], self.Y[index + 1]
+        return Y0 - phi0 * (Y1 - Y0) / (phi1 - phi0)
+
+    def update(self):
+        """Recalculate the fill height and void size.
+
+        Returns:
+            the reason to stop the run, "filled" or "void", or None
+
+        """
+        zeros = self.getZeros()
+        if len(zeros) < 2:
+            self.void_size = 0.
+        else:
+            self.void_size = min(max((zeros[1:] - zeros[:-1])[::2]) / self.featureDepth, 1.)
+
+        if len(zeros) % 2 == 0:
+            self.height = 1.
+        else:
+            self.height = min((self.featureDepth + zeros[-1]) / self.featureDepth, 1.)
+
+        self.void_volume = sum(void['volume'] for void in getattr(self.distance, 'voids', []))
+
+        if self.stop_on_void and (self.void_size > 0 or self.void_volume > 0):
+            self.reason = 'void'
+        elif self.height >= self.fill_height:
+            self.reason = 'filled'
+        else:
+            self.reason = None
+        return self.reason
@@ -10,7 +10,7 @@ class DummyViewer(object):
         self.ax = ax
         self.record = record
 
-    def plotSetup(self, indices=None, times=None, maxFeatureDepth=None, cutoff=False):
+    def plotSetup(self, indices=None, times=None, cutoff=False, xlim=None, ylim=None):
         pass
 
     def getFeatureDepth(self):
@@ -58,7 +58,7 @@ class MultiViewer(_BaseViewer):
             viewer.mirror = self.mirror
             viewer.cutoff = self.cutoff
             viewer.cutoffvalue = self.cutoffvalue
-            viewer.plotSetup(indices=indices, times=times, maxFeatureDepth=maxFeatureDepth, cutoff=cutoff, xlim=xlim, ylim=ylim)
+            viewer.plotSetup(indices=indices, times=times, cutoff=cutoff, xlim=xlim, ylim=ylim)
             ax = viewer.ax
             labels = [''] * len(ax.get_yticklabels())
             ax.set_yticklabels(labels)
@@ -0,0 +1,201 @@
+from collections import OrderedDict
+import resource
+import time
+import tracemalloc
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullProfiler(object):
+    """Profiler that records nothing.
+
+    Used when profiling is disabled so that the simulation loop can
+    mark its phases unconditionally.
+    """
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def start(self):
+        pass
+
+    def end_step(self, step):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler(object):
+    """Record the wall time of the phases of each time step.
+
+    The simulation loop wraps each phase (advection, the sweep of each
+    equation, extension and so on) with `phase` and calls `end_step`
+    at the end of the step. Each step is streamed to a CSV file in long
+    format with one row per phase giving the wall time and the number
+    of calls, along with a "step" row giving the wall time of the
+    whole step and the peak memory allocated during the step. The
+    memory is measured with tracemalloc, which is only running while
+    the records are streamed to a file.
+
+    Attributes:
+        totals: the total time and calls for each phase over the run
+        steps: the number of steps recorded
+        peak_memory: the largest peak memory of a step in MB or None
+            if the memory is not traced
+
+    >>> profiler = Profiler()
+    >>> profiler.start()
+    >>> with profiler.phase('advection'):
+    ...     pass
+    >>> for _ in range(2):
+    ...     with profiler.phase('potential'):
+    ...         pass
+    >>> profiler.end_step(0)
+    >>> [(k, v[1]) for k, v in profiler.totals.items()]
+    [('advection', 1), ('potential', 2)]
+    >>> print(profiler.report().splitlines()[0])
+    phase                  seconds  fraction     calls  seconds/call
+    """
+    def __init__(self, filename=None):
+        """Init for Profiler.
+
+        Args:
+            filename: the CSV file to stream the records to or None to
+                only keep the totals
+
+        """
+        self.enabled = True
+        self.totals = OrderedDict()
+        self.steps = 0
+        self.elapsed = 0.
+        self._record = OrderedDict()
+        self._start = time.perf_counter()
+        self.stream = None
+        self.peak_memory = None
+        self._tracing = False
+        if filename is not None:
+            self.stream = open(filename, 'w')
+            self.stream.write('step,phase,seconds,calls,step_peak_memory_mb\n')
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+
+    def start(self):
+        """Start timing the first step.
+        """
+        self._start = time.perf_counter()
+        if self.stream is not None:
+            tracemalloc.reset_peak()
+
+    def phase(self, name):
+        """Context manager to time a phase of the step.
+
+        Args:
+            name: the name of the phase
+
+        """
+        return _Phase(self, name)
+
+    def _add(self, name, seconds):
+        total, calls = self._record.get(name, (0., 0))
+        self._record[name] = (total + seconds, calls + 1)
+
+    def end_step(self, step):
+        """Record the phases of the step and start a new step.
+
+        Args:
+            step: the step number
+
+        """
+        now = time.perf_counter()
+        step_time = now - self._start
+        self._start = now
+        self.elapsed += step_time
+        self.steps += 1
+        for name, (seconds, calls) in self._record.items():
+            total, total_calls = self.totals.get(name, (0., 0))
+            self.totals[name] = (total + seconds, total_calls + calls)
+        if self.stream is not None:
+            memory = tracemalloc.get_traced_memory()[1] / 1024.**2
+            tracemalloc.reset_peak()
+            self.peak_memory = max(memory, self.peak_memory or 0.)
+            for name, (seconds, calls) in self._record.items():
+                self.stream.write('{0},{1},{2:.6e},{3},\n'.format(step, name, seconds, calls))
+            self.stream.write('{0},step,{1:.6e},1,{2:.1f}\n'.format(step, step_time, memory))
+        self._record = OrderedDict()
+
+    def report(self):
+        """Summary of the time in each phase over the run.
+
+        Returns:
+            a table as a string
+
+        """
+        lines = ['{0:<18}{1:>12}{2:>10}{3:>10}{4:>14}'.format('phase', 'seconds', 'fraction', 'calls', 'seconds/call')]
+        for name, (seconds, calls) in self.totals.items():
+            fraction = seconds / max(self.elapsed, 1e-300)
+            lines.append('{0:<18}{1:12.4e}{2:10.3f}{3:10d}{4:14.4e}'.format(name, seconds, fraction,
+                                                                            calls, seconds / calls))
+        lines.append('{0:<18}{1:12.4e}{2:10.3f}{3:10d}'.format('total', self.elapsed, 1., self.steps))
+        if self.peak_memory is not None:
+            lines.append('largest step peak memory {0:.1f} MB'.format(self.peak_memory))
+        lines.append('process max RSS so far {0:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+        return '\n'.join(lines)
+
+    def close(self):
+        """Close the CSV file.
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+
+def get_profiler(params):
+    """Create the profiler given by the optional `params.profile`.
+
+    `params.profile` is False (the default) to disable profiling, True
+    to only keep the totals or the name of a CSV file for the step
+    records.
+
+    Args:
+        params: the parameters
+
+    Returns:
+        a `Profiler` or a `NullProfiler`
+
+    >>> from collections import namedtuple
+    >>> get_profiler(namedtuple('Params', [])()).enabled
+    False
+    >>> get_profiler(namedtuple('Params', ['profile'])(True)).enabled
+    True
+    """
+    profile = getattr(params, 'profile', False)
+    if not profile:
+        return NullProfiler()
+    return Profiler(filename=None if profile is True else profile)
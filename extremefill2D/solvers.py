@@ -0,0 +1,209 @@
+import numpy as np
+from scipy.sparse.linalg import splu
+from fipy.solvers.scipy import LinearLUSolver, LinearGMRESSolver
+from fipy.solvers.scipy import LinearBicgstabSolver, LinearCGSolver
+from fipy.solvers.scipy import LinearCGSSolver
+from fipy.solvers.scipy.preconditioners import ILUPreconditioner
+from fipy.solvers.scipy.preconditioners import JacobiPreconditioner
+from fipy.solvers.scipy.preconditioners.scipyPreconditioner import ScipyPreconditioner
+from fipy.tools import numerix
+
+
+class CachedLUSolver(LinearLUSolver):
+    """LU solver that reuses the factorization structure between solves.
+
+    The column ordering calculated by SuperLU for the first
+    factorization is stored and reapplied for as long as the sparsity
+    pattern of the matrix does not change, so that subsequent solves
+    only redo the numeric factorization. If `reuse_tol` is positive
+    and the matrix entries have changed by less than `reuse_tol`
+    (relative to the last factorization) the previous factors are used
+    as a preconditioner for the iterative refinement and no
+    factorization is done at all. The factors are recalculated if the
+    refinement fails to converge.
+
+    Attributes:
+        symbolic_count: number of factorizations including the column ordering
+        numeric_count: number of numeric only factorizations
+        reuse_count: number of solves with the previous factors
+
+    """
+    def __init__(self, reuse_tol=0., tolerance="default", criterion="default", iterations="default"):
+        """Init for CachedLUSolver.
+
+        Args:
+            reuse_tol: the relative change in the matrix entries below
+                which the previous factors are reused
+            tolerance: the tolerance for the iterative refinement
+            criterion: the interpretation of the tolerance
+            iterations: the maximum number of refinement iterations
+
+        """
+        super(CachedLUSolver, self).__init__(tolerance=tolerance,
+                                             criterion=criterion,
+                                             iterations=iterations)
+        self.reuse_tol = reuse_tol
+        self.reset()
+
+    def reset(self):
+        """Discard the cached factorization and the counts.
+        """
+        self._indptr = None
+        self._indices = None
+        self._data = None
+        self._order = None
+        self._perm = None
+        self._LU = None
+        self.symbolic_count = 0
+        self.numeric_count = 0
+        self.reuse_count = 0
+
+    def _samePattern(self, L):
+        return self._indptr is not None \
+          and np.array_equal(self._indptr, L.indptr) \
+          and np.array_equal(self._indices, L.indices)
+
+    def _canReuse(self, L):
+        if self.reuse_tol <= 0 or self._LU is None or not self._samePattern(L):
+            return False
+        change = np.linalg.norm(L.data - self._data)
+        return change <= self.reuse_tol * np.linalg.norm(self._data)
+
+    def _factorize(self, L, maxdiag):
+        if self._samePattern(L):
+            self._LU = splu(L[:, self._order],
+                            diag_pivot_thresh=maxdiag,
+                            relax=1,
+                            panel_size=10,
+                            permc_spec='NATURAL')
+            self._perm = self._order
+            self.numeric_count += 1
+        else:
+            self._LU = splu(L,
+                            diag_pivot_thresh=maxdiag,
+                            relax=1,
+                            panel_size=10,
+                            permc_spec=3)
+            self._order = np.argsort(self._LU.perm_c)
+            self._perm = None
+            self._indptr = L.indptr.copy()
+            self._indices = L.indices.copy()
+            self.symbolic_count += 1
+        self._data = L.data.copy()
+
+    def _luSolve(self, residualVector):
+        if self._perm is None:
+            return self._LU.solve(residualVector)
+        xError = np.empty_like(residualVector)
+        xError[self._perm] = self._LU.solve(residualVector)
+        return xError
+
+    def _refine(self, L, x, b, tolerance):
+        for iteration in range(min(self.iterations, 10)):
+            residualVector, residual = self._residualVectorAndNorm(L, x, b)
+            if residual <= tolerance:
+                break
+            x[:] = x - self._luSolve(residualVector)
+        return iteration, residual
+
+    def _solve_(self, L, x, b):
+        diag = L.diagonal()
+        maxdiag = max(numerix.absolute(diag))
+        L = (L * (1 / maxdiag)).tocsc()
+        L.sort_indices()
+        b = b * (1 / maxdiag)
+
+        tolerance_scale, _ = self._adaptTolerance(L, x, b)
+        tolerance = self.tolerance * tolerance_scale
+
+        if self._canReuse(L):
+            self.reuse_count += 1
+            iteration, residual = self._refine(L, x, b, tolerance)
+            if residual > tolerance:
+                self._factorize(L, maxdiag)
+                iteration, residual = self._refine(L, x, b, tolerance)
+        else:
+            self._factorize(L, maxdiag)
+            iteration, residual = self._refine(L, x, b, tolerance)
+
+        self._setConvergence(suite="scipy",
+                             code=0,
+                             iterations=iteration + 1,
+                             residual=residual)
+
+        self.convergence.warn()
+
+        return x
+
+
+class AMGPreconditioner(ScipyPreconditioner):
+    """Smoothed aggregation algebraic multigrid preconditioner.
+
+    Requires PyAMG.
+    """
+    def _applyToMatrix(self, matrix):
+        import pyamg
+        multilevel = pyamg.smoothed_aggregation_solver(matrix.tocsr())
+        return multilevel.aspreconditioner(cycle='V'), matrix
+
+
+KRYLOV_SOLVERS = {'gmres' : LinearGMRESSolver,
+                  'bicgstab' : LinearBicgstabSolver,
+                  'cg' : LinearCGSolver,
+                  'cgs' : LinearCGSSolver}
+
+
+PRECONDITIONERS = {'ilu' : ILUPreconditioner,
+                   'jacobi' : JacobiPreconditioner,
+                   'amg' : AMGPreconditioner}
+
+
+def get_solver(params, name, criterion="default"):
+    """Create the linear solver for an equation.
+
+    The solver is chosen with the optional `params.solver`, either a
+    single specification for all the equations or a dictionary of
+    specifications keyed by the equation name. A specification is
+    "lu" for the `CachedLUSolver` or a Krylov method with an optional
+    preconditioner such as "gmres", "gmres+ilu" or "cg+amg". The
+    Krylov solvers use `params.solver_tol` and start from the current
+    value of the variable, which is the old value at the start of each
+    time step.
+
+    Args:
+        params: the parameters
+        name: the equation name, e.g. "potential"
+        criterion: the fipy convergence criterion for the solver
+
+    Returns:
+        a fipy solver
+
+    >>> from collections import namedtuple
+    >>> Params = namedtuple('Params', ['solver', 'solver_tol'])
+    >>> params = Params(solver=dict(potential='gmres+ilu'), solver_tol=1e-8)
+    >>> solver = get_solver(params, 'potential')
+    >>> type(solver).__name__, type(solver.preconditioner).__name__
+    ('LinearGMRESSolver', 'ILUPreconditioner')
+    >>> type(get_solver(params, 'cupric')).__name__
+    'CachedLUSolver'
+    >>> get_solver(Params(solver='lu+ilu', solver_tol=1e-8), 'theta')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown solver specification lu+ilu
+    """
+    spec = getattr(params, 'solver', 'lu')
+    if isinstance(spec, dict):
+        spec = spec.get(name, 'lu')
+
+    method, _, precon = spec.lower().partition('+')
+
+    if method == 'lu' and not precon:
+        return CachedLUSolver(reuse_tol=getattr(params, 'lu_reuse_tol', 0.),
+                              criterion=criterion)
+    elif method in KRYLOV_SOLVERS and (not precon or precon in PRECONDITIONERS):
+        precon = PRECONDITIONERS[precon]() if precon else None
+        return KRYLOV_SOLVERS[method](tolerance=params.solver_tol,
+                                      criterion=criterion,
+                                      precon=precon)
+    else:
+        raise ValueError("unknown solver specification {0}".format(spec))
@@ -0,0 +1,132 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class StencilOperator(object):
+    """Finite volume operators assembled directly on the (ny, nx) grid.
+
+    `ExtremeFill2DMesh` is a tensor product of the spacings `dx` and
+    `dy` so a diffusion operator only couples each cell to the cells
+    above, below, left and right of it. The geometry of the cylindrical
+    cells is calculated from the cell centers and the spacings and the
+    sparsity pattern of the 5-point matrix is built once, so assembly
+    is only a few vectorized operations filling in the matrix entries.
+    The discretization is the same as fipy's for the `DiffusionTerm`,
+    `TransientTerm`, `ImplicitSourceTerm` and fixed value constraints
+    on the top faces.
+
+    Attributes:
+        shape: the (ny, nx) shape of the cell arrays
+        volumes: the cell volumes
+
+    >>> import fipy as fp
+    >>> from fipy.meshes.cylindricalNonUniformGrid2D import CylindricalNonUniformGrid2D
+    >>> from fipy.solvers.scipy import LinearLUSolver
+    >>> mesh = CylindricalNonUniformGrid2D(dx=(1., 2.), dy=(1., 1., 3.), origin=((1.,), (0.,)))
+    >>> var = fp.CellVariable(mesh=mesh, value=np.arange(6.))
+    >>> var.constrain(5., mesh.facesTop)
+    >>> solver = LinearLUSolver()
+    >>> _ = (fp.DiffusionTerm(2.) == fp.ImplicitSourceTerm(3.)).sweep(var, solver=solver)
+    >>> operator = StencilOperator(mesh)
+    >>> L = operator.matrix(2., 3., fixed_top=True)
+    >>> print(np.allclose(L.toarray(), -solver.matrix.matrix.toarray()))
+    True
+    >>> print(operator.top(2.) * 5)
+    [ 0.  0.  0.  0. 10. 40.]
+    """
+    def __init__(self, mesh):
+        """Init for StencilOperator.
+
+        Args:
+            mesh: a fipy cylindrical non-uniform grid
+
+        """
+        nx, ny = mesh.nx, mesh.ny
+        self.shape = (ny, nx)
+        dx = np.array(mesh.dx, dtype=float)
+        dy = np.array(mesh.dy, dtype=float)
+        x = np.array(mesh.cellCenters[0][:nx])
+        y = np.array(mesh.cellCenters[1][::nx])
+        x_faces = np.concatenate(([x[0] - dx[0] / 2], x + dx / 2))
+
+        self.volumes = np.outer(dy, dx * x).flatten()
+        ## area over distance for the interior horizontal faces
+        ## (ny - 1, nx) and vertical faces (ny, nx - 1)
+        self._horizontal = np.outer(1 / np.diff(y), dx * x)
+        self._vertical = np.outer(dy, x_faces[1:-1] / np.diff(x))
+        self._top = dx * x / (dy[-1] / 2)
+        self._nh = (ny + 1) * nx
+
+        N = nx * ny
+        ids = np.arange(N).reshape(ny, nx)
+        lower, upper = ids[:-1].flatten(), ids[1:].flatten()
+        left, right = ids[:, :-1].flatten(), ids[:, 1:].flatten()
+        rows = np.concatenate((ids.flatten(), lower, upper, left, right))
+        cols = np.concatenate((ids.flatten(), upper, lower, right, left))
+        template = csr_matrix((np.arange(1, len(rows) + 1), (rows, cols)), shape=(N, N))
+        self._indptr = template.indptr
+        self._indices = template.indices
+        self._order = template.data - 1
+
+    def _faceCoefficients(self, coeff):
+        """The coefficient on the interior horizontal and vertical faces
+        given a scalar or a value for each face in fipy's numbering.
+        """
+        ny, nx = self.shape
+        if np.isscalar(coeff):
+            return coeff, coeff
+        coeff = np.asarray(coeff)
+        return (coeff[:self._nh].reshape(ny + 1, nx)[1:-1],
+                coeff[self._nh:].reshape(ny, nx + 1)[:, 1:-1])
+
+    def top(self, diffusion):
+        """The coefficient coupling the top row of cells to a fixed
+        value on the top faces.
+
+        Args:
+            diffusion: the diffusion coefficient, a scalar or a value
+                for each face
+
+        Returns:
+            the coefficient for each cell, zero below the top row
+
+        """
+        ny, nx = self.shape
+        if not np.isscalar(diffusion):
+            diffusion = np.asarray(diffusion)[self._nh - nx:self._nh]
+        value = np.zeros(ny * nx)
+        value[-nx:] = diffusion * self._top
+        return value
+
+    def matrix(self, diffusion, diagonal, fixed_top=False):
+        """Assemble the 5-point matrix.
+
+        The matrix is the negative of the diffusion operator plus the
+        diagonal coefficient multiplied by the cell volumes.
+
+        Args:
+            diffusion: the diffusion coefficient, a scalar or a value
+                for each face
+            diagonal: the diagonal coefficient per unit volume, a
+                scalar or a value for each cell
+            fixed_top: whether the value is fixed on the top faces
+                rather than having no flux
+
+        Returns:
+            the matrix in CSR format
+
+        """
+        horizontal, vertical = self._faceCoefficients(diffusion)
+        horizontal = (horizontal * self._horizontal).flatten()
+        vertical = (vertical * self._vertical).flatten()
+        ny, nx = self.shape
+        diag = np.asarray(diagonal * self.volumes, dtype=float).copy()
+        diag[:-nx] += horizontal
+        diag[nx:] += horizontal
+        diag.reshape(ny, nx)[:, :-1] += vertical.reshape(ny, nx - 1)
+        diag.reshape(ny, nx)[:, 1:] += vertical.reshape(ny, nx - 1)
+        if fixed_top:
+            diag += self.top(diffusion)
+        data = np.concatenate((diag, -horizontal, -horizontal, -vertical, -vertical))
+        N = nx * ny
+        return csr_matrix((data[self._order], self._indices, self._indptr), shape=(N, N))
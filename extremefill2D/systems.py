@@ -1,21 +1,57 @@
 from collections import OrderedDict
+import warnings
 
 
+import numpy as np
 import pandas as pd
 import fipy as fp
 from extremefill2D.variables import Variables, MaskedVariablesCorner
-from extremefill2D.equations import PotentialEquation, CupricEquation
-from extremefill2D.equations import SuppressorEquation, ThetaEquation
-from extremefill2D.equations import AdvectionEquation, AppliedPotentialEquation
-from extremefill2D.meshes import ExtremeFill2DMesh
+from extremefill2D.equations import get_field_equations
+from extremefill2D.equations import get_advection_equation, AppliedPotentialEquation
+from extremefill2D.equations import CoupledEquation, GalvanostaticPotentialEquation
+from extremefill2D.equations import converge_sweeps
+from extremefill2D.meshes import get_mesh
+from extremefill2D.monitors import FillMonitor
+from extremefill2D.profiling import get_profiler
+from extremefill2D.logger import get_logger
 
 class ExtremeFillSystem(object):
-    def __init__(self, params, dataWriter=None):
+    def __init__(self, params, dataWriter=None, logger=None, profiler=None):
         self.params = params
         self.dataWriter = dataWriter
-
-        mesh = ExtremeFill2DMesh(params)
-
+        self._owns_logger = logger is None
+        self.logger = logger if logger is not None else get_logger(params)
+        self.monitor_frequency = getattr(params, 'monitor_frequency', 0)
+        self.adaptive_mesh = getattr(params, 'adaptive_mesh', False)
+        self.remesh_padding = getattr(params, 'remesh_padding', 2 * params.levelset_update_ncell)
+        self.remesh_count = 0
+
+        self.build(get_mesh(params))
+
+        self.extensionGlobalValue = None
+        self.extension_count = 0
+
+        self.substeps = getattr(params, 'advection_substeps', 1)
+        self.step_controller = getattr(params, 'step_controller', 'growth')
+        self.dt_safety = getattr(params, 'dt_safety', 0.9)
+        self.dt_growth_max = getattr(params, 'dt_growth_max', 2.0)
+        self.dt_residual_tol = getattr(params, 'dt_residual_tol', None)
+        self.max_rejections = getattr(params, 'max_rejections', 2)
+        self.accepted_steps = 0
+        self.rejected_steps = 0
+        self._cfl = None
+        self._residual = None
+        self._rejections = 0
+        self.termination_reason = None
+        self._owns_profiler = profiler is None
+        self.profiler = profiler if profiler is not None else get_profiler(params)
+        self.elapsedTime = 0.0
+        self.dt = params.dt
+
+    def build(self, mesh):
+        """Create the variables and equations on the mesh.
+        """
+        params = self.params
         variables = self.getVariables(params, mesh)
 
         self.distance = variables.distance
@@ -23,40 +59,188 @@ class ExtremeFillSystem(object):
         self.current = variables.current
         self.depositionRate = variables.depositionRate
         self.variables = variables
-        self.equations = (PotentialEquation(params, variables),
-                          CupricEquation(params, variables),
-                          SuppressorEquation(params, variables),
-                          ThetaEquation(params, variables))
+        self.equations = get_field_equations(params, variables)
 
-        self.advection = AdvectionEquation(params, variables)
+        if getattr(params, 'coupled', False):
+            self.coupled = CoupledEquation(params, variables)
+        else:
+            self.coupled = None
+
+        self.advection = get_advection_equation(params, variables)
+        self.distanceOld = np.array(self.distance)
+
+        if self.monitor_frequency > 0:
+            self.monitor = FillMonitor(params, self.distance)
+        else:
+            self.monitor = None
 
     def getVariables(self, params, mesh):
         return Variables(params, mesh)
 
+    def coarse_height(self):
+        """The height above the bottom of the feature below which
+        there is no electrolyte, less `remesh_padding` cells.
+        """
+        mesh = self.distance.mesh
+        y = np.array(mesh.y)[np.array(self.distance) > 0]
+        front = min(y) + self.params.featureDepth if len(y) > 0 else 0.
+        return min(max(front - self.remesh_padding * mesh.nominal_dx, 0.), mesh.max_coarse_height)
+
+    def remesh(self, coarse_height):
+        """Move the variables to a mesh coarsened, or truncated if
+        `params.adaptive_mesh` is "truncate", below `coarse_height`.
+
+        The distance, potential, cupric, suppressor and theta values
+        and the applied potential are transferred conservatively and
+        the variables and equations are rebuilt.
+        """
+        old_mesh = self.distance.mesh
+        old_variables = self.variables
+        mesh = get_mesh(self.params, coarse_height=coarse_height,
+                       truncate=self.adaptive_mesh == 'truncate')
+        self.build(mesh)
+        for name in ('distance', 'potential', 'cupric', 'suppressor', 'theta'):
+            value = mesh.remap(np.array(getattr(old_variables, name)), old_mesh)
+            getattr(self.variables, name).setValue(value)
+        self.variables.appliedPotential.setValue(float(old_variables.appliedPotential))
+        self.updateOld()
+        self.extensionGlobalValue = None
+        self.remesh_count += 1
+
+    def adapt_mesh(self):
+        """Remesh if the fill front has moved by
+        `levelset_update_ncell` cells or more past the start of the fine
+        region or has dropped below it. A truncated mesh is never
+        extended back down as the removed values are lost.
+        """
+        mesh = self.distance.mesh
+        coarse_height = self.coarse_height()
+        change = (coarse_height - mesh.coarse_height) / mesh.nominal_dx
+        if change >= self.params.levelset_update_ncell \
+           or (change < 0 and self.adaptive_mesh != 'truncate'):
+            self.remesh(coarse_height)
+
+    def interpolate_from(self, system):
+        """Continue from another system run at a different resolution.
+
+        The distance, potential, cupric and suppressor values are
+        interpolated linearly and the distance is reinitialized. The
+        surfactant coverage is extended away from the interface on the
+        other mesh before it is interpolated and is converted back to
+        theta with the interface areas on this mesh. The applied
+        potential, elapsed time and time step are carried over.
+        """
+        mesh = self.distance.mesh
+        other_mesh = system.distance.mesh
+        for name in ('distance', 'potential', 'cupric', 'suppressor'):
+            value = mesh.interpolate(np.array(getattr(system.variables, name)), other_mesh)
+            getattr(self.variables, name).setValue(value)
+        self.distance.calcDistanceFunction(order=1)
+        coverage = fp.CellVariable(mesh=other_mesh, value=system.variables.interfaceTheta)
+        system.distance.extendVariable(coverage)
+        coverage = mesh.interpolate(np.array(coverage), other_mesh)
+        self.variables.theta.setValue(coverage * np.array(self.variables.surface))
+        self.variables.appliedPotential.setValue(float(system.variables.appliedPotential))
+        self.elapsedTime = system.elapsedTime
+        self.dt = system.dt
+        self.updateOld()
+        self.extensionGlobalValue = None
+
     def sweep(self, dt):
-        return OrderedDict([[eqn.var.name, eqn.sweep(dt)] for eqn in self.equations])
+        if self.coupled is not None:
+            with self.profiler.phase(self.coupled.name):
+                return self.coupled.sweep(dt)
+        residuals = OrderedDict()
+        for eqn in self.equations:
+            with self.profiler.phase(eqn.name):
+                residuals[eqn.var.name] = eqn.sweep(dt)
+        return residuals
+
+    def residual_keys(self):
+        return [(eqn.name, eqn.var.name) for eqn in self.equations]
+
+    def converge_sweeps(self, dt):
+        return converge_sweeps(lambda: self.sweep(dt), self.residual_keys(), self.params)
 
     def updateOld(self):
         for eqn in self.equations:
             eqn.var.updateOld()
-        self.distanceOld = fp.numerix.array(self.distance).copy()
+            eqn.newStep()
+        np.copyto(self.distanceOld, self.distance.value)
 
     def update_dt(self, dt, params, mesh):
-        extensionGlobalValue = self.extend()
-        dt = min(float(params.CFL * mesh.nominal_dx / extensionGlobalValue), dt * 1.1)
+        if self.extensionGlobalValue is None:
+            self.extend()
+        dt_cfl = float(self.substeps * params.CFL * mesh.nominal_dx / self.extensionGlobalValue)
+        if self.step_controller == 'pi':
+            dt = min(self.dt_safety * dt_cfl, self.pi_dt(dt))
+        else:
+            dt = min(dt_cfl, dt * 1.1)
         dt = min(dt, params.dtMax)
         return max(dt, params.dtMin)
 
-    def extend(self):
+    def pi_dt(self, dt):
+        """Proportional-integral control of the time step.
+
+        The time step is chosen so that the CFL number at the end of
+        the step, measured with the extension velocity after the
+        sweeps, approaches `dt_safety` times `params.CFL`. If
+        `params.dt_residual_tol` is set the residual of the first
+        sweep, which grows with the change over the step, is also
+        controlled to that tolerance. The time step does not grow
+        after a rejected step.
+        """
+        if self._rejections > 0:
+            return dt
+        factor = self.dt_growth_max
+        for measures, target in ((self._cfl, self.dt_safety),
+                                 (self._residual, self.dt_residual_tol)):
+            if measures is not None and target is not None:
+                current, previous = [max(m, 1e-300) for m in measures]
+                factor = min(factor, (target / current)**0.6 * (previous / current)**0.2)
+        return dt * factor
+
+    def accept_step(self, dt, residuals, mesh):
+        cfl = dt * self.extensionGlobalValue / (self.substeps * self.params.CFL * mesh.nominal_dx)
+        self._cfl = (cfl, cfl if self._cfl is None else self._cfl[0])
+        residual = max(residuals[0][key] for _, key in self.residual_keys())
+        self._residual = (residual, residual if self._residual is None else self._residual[0])
+        self._rejections = 0
+        self.accepted_steps += 1
+
+    def advect(self, dt):
+        """Advect the level set with `advection_substeps` equal
+        substeps, holding the extension velocity fixed.
+        """
+        with self.profiler.phase('advection'):
+            for _ in range(self.substeps):
+                self.advection.solve(dt / self.substeps)
+
+    def extend(self, reinitialize=False):
         self.extension[:] = self.depositionRate
-        self.distance.extendVariable(self.extension)
-        return max(self.extension.globalValue)
+        if reinitialize:
+            with self.profiler.phase('reinitialization'):
+                self.distance.reinitializeAndExtend(self.extension, order=1)
+        else:
+            with self.profiler.phase('extension'):
+                self.distance.extendVariable(self.extension)
+        self.extension_count += 1
+        self.extensionGlobalValue = max(self.extension.globalValue)
+        return self.extensionGlobalValue
 
     def revert_step(self, dt):
-        dt = dt * 0.1
+        if self.step_controller == 'pi':
+            mesh = self.distance.mesh
+            dt = self.dt_safety * self.substeps * self.params.CFL * mesh.nominal_dx / self.extensionGlobalValue
+        else:
+            dt = dt * 0.1
+        self._rejections += 1
+        self.rejected_steps += 1
         for eqn in self.equations:
             eqn.var[:] = eqn.var.old
+            eqn.newStep()
         self.distance[:] = self.distanceOld
+        self.extensionGlobalValue = None
         return dt
 
     def print_data(self, step, elapsedTime, dt, redo_timestep, residuals):
@@ -82,66 +266,235 @@ class ExtremeFillSystem(object):
         print
         print(df_residuals.to_string(float_format=float_format))
 
-    def run(self, print_data=True):
+    def run(self, print_data=None):
+        """Run the simulation.
+
+        The steps are passed to `self.logger` if there is one. A
+        logger created from `params.log_file` is closed at the end of
+        the run and one passed to the constructor is left open. With
+        profiling enabled, the report is passed to the logger at the
+        end of the run. The
+        residuals are printed every step if `print_data` is True, which
+        is the default when there is no logger. The number of extension
+        velocity calculations in each step is kept in
+        `self.extension_history`.
+        """
         params = self.params
+        if print_data is None:
+            print_data = self.logger is None
         mesh = self.distance.mesh
 
         redo_timestep = False
-        elapsedTime = 0.0
+        elapsedTime = self.elapsedTime
         step = 0
-        dt = params.dt
+        dt = self.dt
         extensionGlobalValue = max(self.variables.extension.globalValue)
+        self.convergence_history = []
+        self.extension_history = []
+        self.termination_reason = None
+        self.profiler.start()
 
         while (step < params.totalSteps) and (elapsedTime < params.totalTime):
 
             self.updateOld()
+            extension_count = self.extension_count
 
             if self.dataWriter and (step % params.data_frequency == 0) and (not redo_timestep):
-                self.dataWriter.write(elapsedTime, step, self.variables)
+                with self.profiler.phase('write'):
+                    self.dataWriter.write(elapsedTime, step, self.variables)
                 if step > 0 and extensionGlobalValue < params.shutdown_deposition_rate:
+                    self.termination_reason = 'shutdown'
+                    break
+
+            if self.monitor and (step % self.monitor_frequency == 0) and (not redo_timestep):
+                self.termination_reason = self.check_termination(step, extensionGlobalValue)
+                if self.termination_reason is not None:
+                    if self.dataWriter and (step % params.data_frequency != 0):
+                        self.dataWriter.write(elapsedTime, step, self.variables)
                     break
 
-            if (step % int(params.levelset_update_ncell / params.CFL) == 0):
-                self.distance.deleteIslands()
-                self.distance.calcDistanceFunction(order=1)
+            if (step % max(int(params.levelset_update_ncell / params.CFL / self.substeps), 1) == 0):
+                if self.adaptive_mesh:
+                    with self.profiler.phase('remesh'):
+                        self.adapt_mesh()
+                    mesh = self.distance.mesh
+                with self.profiler.phase('islands'):
+                    self.distance.deleteIslands()
+                self.extend(reinitialize=True)
 
-            dt = self.update_dt(dt, params, mesh)
+            dt = self.dt = self.update_dt(dt, params, mesh)
+            dt = min(dt, params.totalTime - elapsedTime)
 
-            self.advection.solve(dt)
+            self.advect(dt)
 
-            residuals = [self.sweep(dt) for _ in range(params.sweeps)]
+            residuals = self.converge_sweeps(dt)
+            self.convergence_history.append((step, len(residuals), residuals[-1]))
+            profiled_step = step
 
             extensionGlobalValue = self.extend()
+            extensions = self.extension_count - extension_count
+            self.extension_history.append(extensions)
 
-            if dt > (params.CFL * mesh.nominal_dx / extensionGlobalValue * 1.1):
+            if dt / self.substeps > (params.CFL * mesh.nominal_dx / extensionGlobalValue * 1.1):
                 dt = self.revert_step(dt)
-                if redo_timestep:
+                if self._rejections >= self.max_rejections:
+                    self.termination_reason = 'rejections'
                     break
-                else:
-                    redo_timestep = True
+                redo_timestep = True
                 print("CFL number has been exceeded")
             else:
+                self.accept_step(dt, residuals, mesh)
                 elapsedTime += dt
                 step += 1
                 redo_timestep = False
 
+            self.profiler.end_step(profiled_step)
+
+            if self.logger is not None:
+                self.logger.log(step, elapsedTime, dt, redo_timestep, residuals, extensions=extensions)
             if print_data:
                 self.print_data(step, elapsedTime, dt, redo_timestep, residuals)
 
+        self.elapsedTime = elapsedTime
+        if self.termination_reason is None:
+            self.termination_reason = 'totalSteps' if step >= params.totalSteps else 'totalTime'
+        if self._owns_profiler:
+            self.profiler.close()
+            self.report_profile(print_data)
+        if self._owns_logger and self.logger is not None:
+            self.logger.close()
+
+    def report_profile(self, print_data):
+        """Pass the profiling report to the logger, and print it if
+        `print_data` is True. Does nothing if profiling is disabled.
+        """
+        if not self.profiler.enabled:
+            return
+        report = self.profiler.report()
+        if self.logger is not None:
+            self.logger.log_report(report)
+        if print_data:
+            print(report)
+
+    def check_termination(self, step, extensionGlobalValue):
+        """Check the fill monitor and the deposition rate.
+
+        Returns "filled" or "void" from the monitor, "shutdown" if
+        the deposition rate has dropped below
+        `params.shutdown_deposition_rate` or None to carry on.
+        """
+        reason = self.monitor.update()
+        if reason is None and step > 0 and extensionGlobalValue < self.params.shutdown_deposition_rate:
+            reason = 'shutdown'
+        return reason
+
 
 
 
 class ConstantCurrentSystem(ExtremeFillSystem):
-    def __init__(self, params, datafile=None):
-        super(ConstantCurrentSystem, self).__init__(params, datafile)
-        self.appliedPotentialEqn = AppliedPotentialEquation(params, self.variables)
+    def __init__(self, params, datafile=None, logger=None, profiler=None):
+        super(ConstantCurrentSystem, self).__init__(params, datafile, logger, profiler)
+
+    def build(self, mesh):
+        super(ConstantCurrentSystem, self).build(mesh)
+        params = self.params
+        if self.coupled is None and getattr(params, 'galvanostatic', 'newton') == 'newton':
+            self.appliedPotentialEqn = None
+            self.equations = (GalvanostaticPotentialEquation(params, self.variables),) + self.equations[1:]
+        else:
+            self.appliedPotentialEqn = AppliedPotentialEquation(params, self.variables)
 
     def sweep(self, dt):
-        residual = self.appliedPotentialEqn.sweep(dt)
-        residuals = super(ConstantCurrentSystem, self).sweep(dt)
-        residuals['appliedPotential'] = residual
+        if self.appliedPotentialEqn is None:
+            residuals = super(ConstantCurrentSystem, self).sweep(dt)
+            residuals['appliedPotential'] = self.equations[0].potentialStep
+        else:
+            with self.profiler.phase('appliedPotential'):
+                residual = self.appliedPotentialEqn.sweep(dt)
+            residuals = super(ConstantCurrentSystem, self).sweep(dt)
+            residuals['appliedPotential'] = residual
         residuals['current'] = float(self.variables.current)
         return residuals
 
+    def residual_keys(self):
+        keys = super(ConstantCurrentSystem, self).residual_keys()
+        return keys + [('appliedPotential', 'appliedPotential')]
+
     def getVariables(self, params, mesh):
         return MaskedVariablesCorner(params, mesh)
+
+
+def continuation_ladder(params):
+    """The resolutions and end times of the stages of a continuation run.
+
+    The stages are given by the optional `params.continuation` as a
+    list of `[Nx, time]` pairs or, with the optional
+    `params.continuation_time`, by a single stage at `params.NxBase`.
+    The final stage is always at `params.Nx` to `params.totalTime`.
+
+    >>> from collections import namedtuple
+    >>> Params = namedtuple('Params', ['Nx', 'NxBase', 'totalTime', 'continuation_time'])
+    >>> continuation_ladder(Params(100, 25, 10., 1.))
+    [(25, 1.0), (100, 10.0)]
+    >>> continuation_ladder(Params(100, 25, 10., None))
+    [(100, 10.0)]
+    """
+    ladder = getattr(params, 'continuation', None)
+    if ladder is None:
+        time = getattr(params, 'continuation_time', None)
+        ladder = [] if time is None else [(params.NxBase, time)]
+    return [(int(Nx), float(time)) for Nx, time in ladder] + [(params.Nx, float(params.totalTime))]
+
+
+def run_continuation(params, dataWriter=None, logger=None, print_data=None, system_class=ExtremeFillSystem):
+    """Run the simulation through the stages of `continuation_ladder`.
+
+    Each stage runs to its end time and the next stage, at a finer
+    resolution, continues from it with `interpolate_from`. The data
+    is only written in the final stage. If a coarser stage stops
+    before its end time, for example on `params.totalSteps` or a
+    shutdown, a warning is issued, the final state of that stage is
+    written and the run stops there.
+
+    The logger and profiler are shared by all the stages so that the
+    records of the coarse stages are kept. The profiling report for
+    all the stages is passed to the logger after the last stage. A
+    logger created from `params.log_file` and the profiler are closed
+    at the end.
+
+    Returns:
+        the system of the last stage run
+    """
+    owns_logger = logger is None
+    if owns_logger:
+        logger = get_logger(params)
+    profiler = get_profiler(params)
+    system = stage = None
+    try:
+        stages = continuation_ladder(params)
+        for index, (Nx, time) in enumerate(stages):
+            final = index == len(stages) - 1
+            stage = system_class(params._replace(Nx=Nx, totalTime=time),
+                                 dataWriter if final else None,
+                                 logger,
+                                 profiler)
+            if system is not None:
+                stage.interpolate_from(system)
+            stage.run(print_data=print_data)
+            if final:
+                return stage
+            if stage.termination_reason != 'totalTime':
+                warnings.warn('continuation stopped at Nx={0}, time {1:.4e}: {2}'.format(Nx,
+                                                                                       stage.elapsedTime,
+                                                                                       stage.termination_reason))
+                if dataWriter:
+                    dataWriter.write(stage.elapsedTime, stage.accepted_steps, stage.variables)
+                return stage
+            system = stage
+    finally:
+        profiler.close()
+        if stage is not None:
+            stage.report_profile(logger is None if print_data is None else print_data)
+        if owns_logger and logger is not None:
+            logger.close()
+
@@ -287,6 +287,19 @@ def find_all_zeros(f, x0, x1, N=1000):
     from scipy.optimize import brentq
     return np.array([brentq(f, x[ID], x[ID + 1]) for ID in IDs])
 
+def interface_norm(phi, phi_base, dx):
+    """L2 norm of the difference between two level sets in units of
+    the grid spacing. Only cells within 10 grid spacings of the
+    interface of the base level set contribute.
+
+    >>> phi_base = np.array([-15., -1., 1., 15.])
+    >>> print(interface_norm(phi_base + np.array([5., 1., 1., 5.]), phi_base, 1.))
+    0.7071067811865476
+    """
+    diff = abs(phi - phi_base) / dx
+    diff[abs(phi_base) > 10 * dx] = 0.
+    return np.sqrt(np.sum(diff**2) / len(diff))
+
 class FeatureProperty(object):
     def __init__(self, record):
         self.record = record
@@ -295,16 +308,21 @@ class FeatureProperty(object):
         from scipy.interpolate import interp1d
 
         datafile = os.path.join(record.datastore.root, record.output_data[0].path)
-        h5file = tables.openFile(datafile, mode='r')
+        h5file = tables.open_file(datafile, mode='r')
         index = h5file.root._v_attrs.latestIndex
-        data = h5file.getNode('/ID' + str(int(index)))
+        data = h5file.get_node('/ID' + str(int(index)))
 
-        mindx = min(data.dx.read())
         featureDepth = record.parameters['featureDepth']
-        distanceBelowTrench = 10 * mindx
 
-        if not hasattr(self, 'mesh'):
-            self.mesh = fp.Grid2D(nx=data.nx.read(), ny=data.ny.read(), dx=data.dx.read(), dy=data.dy.read()) - [[-mindx / 100.], [distanceBelowTrench + featureDepth]]
+        from .meshes import record_grid, record_grid_key
+        origin = data.origin.read() if 'origin' in data else None
+        args = (data.nx.read(), data.ny.read(), data.dx.read(), data.dy.read())
+        key = record_grid_key(*args, origin=origin)
+        if key != getattr(self, 'meshKey', None):
+            self.meshKey = key
+            self.mesh = record_grid(*args, origin=origin, featureDepth=featureDepth)
+            if hasattr(self, 'nearestCellIDs'):
+                del self.nearestCellIDs
         phi = fp.CellVariable(mesh=self.mesh, value=data.distance.read())
 
         N = 1000
@@ -426,6 +444,33 @@ def refine_contour_plot(points, values):
     return ((tri.points[edges[:,0],:] + tri.points[edges[:,1],:]) / 2)[np.argsort(edgeValue)][::-1]
 
 
+VOID_FIELDS = ('cells', 'volume', 'x', 'y')
+
+
+def voids_to_array(voids):
+    """Pack the voids found by `deleteIslands` into an array with a
+    row for each void and a column for each of `VOID_FIELDS`.
+
+    >>> voids_to_array([dict(cells=3, volume=1e-12, x=1e-6, y=-2e-6)]).shape
+    (1, 4)
+    >>> voids_to_array([]).shape
+    (0, 4)
+    """
+    return np.array([[void[k] for k in VOID_FIELDS] for void in voids], dtype=float).reshape(-1, len(VOID_FIELDS))
+
+
+def voids_from_array(array):
+    """Unpack an array written by `voids_to_array`.
+
+    >>> voids_from_array(voids_to_array([dict(cells=3, volume=1., x=2., y=-2.)]))
+    [{'cells': 3, 'volume': 1.0, 'x': 2.0, 'y': -2.0}]
+    """
+    voids = [dict(zip(VOID_FIELDS, map(float, row))) for row in np.reshape(array, (-1, len(VOID_FIELDS)))]
+    for void in voids:
+        void['cells'] = int(void['cells'])
+    return voids
+
+
 class DataWriter(object):
     def __init__(self, datafile):
         self.datafile = datafile
@@ -438,6 +483,9 @@ class DataWriter(object):
                     'ny' : mesh.ny,
                     'dx' : mesh.dx,
                     'dy' : mesh.dy,
+                    'origin' : np.array([float(mesh.x[0] - mesh.dx[0] / 2.),
+                                         float(mesh.y[0] - mesh.dy[0] / 2.)]),
+                    'voids' : voids_to_array(getattr(variables.distance, 'voids', [])),
                     'distance' : np.array(variables.distance)}
 
 
@@ -1,5 +1,6 @@
 import tables
 import numpy as np
+from scipy import ndimage
 from fipy.variables.surfactantVariable import _InterfaceSurfactantVariable
 import fipy as fp
 from fipy import numerix
@@ -32,9 +33,38 @@ class SuppressorVariable(fp.CellVariable):
         self.constrain(params.bulkSuppressor, self.mesh.facesTop)
 
 
+class _InterfaceGeometryVariable(fp.CellVariable):
+    def __init__(self, distanceVar, key):
+        super(_InterfaceGeometryVariable, self).__init__(distanceVar.mesh, hasOld=False)
+        self.distanceVar = self._requires(distanceVar)
+        self.key = key
+
+    def _getValue(self):
+        if not self.stale and self._value is not None:
+            self.distanceVar.geometry_hits += 1
+        return super(_InterfaceGeometryVariable, self)._getValue()
+
+    value = property(_getValue, fp.CellVariable._setValueProperty)
+
+    def _calcValue(self):
+        return self.distanceVar.interfaceGeometry[self.key]
+
+
 class DistanceVariableNonUniform(fp.DistanceVariable):
+    _geometry = None
+
     def __init__(self, params, mesh):
         super(DistanceVariableNonUniform, self).__init__(mesh=mesh, value=1.)
+        self.geometry_hits = 0
+        self.geometry_misses = 0
+        self._geometryVars = dict()
+        self.narrow_band = getattr(params, 'narrow_band', 0)
+        self.island_size = getattr(params, 'island_size', 1)
+        self.voids = []
+        if self.narrow_band and self.narrow_band <= params.levelset_update_ncell:
+            raise ValueError("narrow_band must be wider than levelset_update_ncell")
+        self.band = np.ones(mesh.numberOfCells, dtype=bool)
+        self.band_ids = np.arange(mesh.numberOfCells)
         self.setValue(-1., where=self.mesh.y < -params.featureDepth)
         self.setValue(-1., where=(self.mesh.y < 0) & (self.mesh.x < params.rinner))
         self.setValue(-1., where=(self.mesh.y < 0) & (self.mesh.x > params.router))
@@ -58,13 +88,172 @@ class DistanceVariableNonUniform(fp.DistanceVariable):
 
         return dx, shape
 
+    def _markFresh(self):
+        self._geometry = None
+        super(DistanceVariableNonUniform, self)._markFresh()
+
+    @property
+    def interfaceGeometry(self):
+        """The interface geometry for the current distance values.
+
+        The face and cell interface flags, the cell interface normals,
+        the cell interface areas and the IDs of the interface cells
+        are calculated together on the first request after a change
+        of the distance and then reused.
+
+        Returns:
+            a dictionary of the geometry arrays
+        """
+        if self._geometry is not None:
+            self.geometry_hits += 1
+            return self._geometry
+
+        self.geometry_misses += 1
+        mesh = self.mesh
+        value = np.array(self._value)
+        adjacentCellIDs = mesh._adjacentCellIDs
+        faceFlag = np.where(value[adjacentCellIDs[0]] * value[adjacentCellIDs[1]] < 0, 1, 0)
+        interfaceNormals = np.where(faceFlag, self._levelSetNormals, 0)
+        cellFaceIDs = mesh.cellFaceIDs
+        valueOverFaces = np.repeat(self._cellValueOverFaces[np.newaxis, ...], mesh.dim, axis=0)
+        cellNormals = MA.where(valueOverFaces < 0, 0, interfaceNormals[..., cellFaceIDs])
+        areaProjections = np.array(MA.filled(mesh._cellAreaProjections, 0))
+        areas = np.sum(abs(np.sum(np.array(MA.filled(cellNormals, 0)) * areaProjections, axis=0)), axis=0)
+        cellFaceFlag = np.sum(MA.filled(np.take(faceFlag, cellFaceIDs), 0), axis=0)
+        cellFlag = np.where((value > 0) & (cellFaceFlag > 0), 1, 0)
+        self._geometry = dict(faceFlag=faceFlag,
+                              cellNormals=cellNormals,
+                              areas=areas,
+                              cellFlag=cellFlag,
+                              interfaceIDs=np.flatnonzero(areas > 0))
+        return self._geometry
+
+    def _geometryVar(self, key):
+        if key not in self._geometryVars:
+            self._geometryVars[key] = _InterfaceGeometryVariable(self, key)
+        return self._geometryVars[key]
+
+    @property
+    def cellInterfaceAreas(self):
+        return self._geometryVar('areas')
+
+    @property
+    def _cellInterfaceFlag(self):
+        return self._geometryVar('cellFlag')
+
+    @property
+    def _interfaceFlag(self):
+        return self.interfaceGeometry['faceFlag']
+
+    @property
+    def _cellInterfaceNormals(self):
+        return self.interfaceGeometry['cellNormals']
+
+    def getNarrow(self):
+        if not self.narrow_band:
+            return None
+        dx, shape = self.getLSMshape()
+        return self.narrow_band * min(dx)
+
+    def calcDistanceFunction(self, order=2):
+        narrow = self.getNarrow()
+        if narrow is None:
+            super(DistanceVariableNonUniform, self).calcDistanceFunction(order=order)
+            return
+
+        import skfmm
+        dx, shape = self.getLSMshape()
+        distance = skfmm.distance(np.array(self._value).reshape(shape), dx=dx, order=order, narrow=narrow)
+        self._setDistance(distance, narrow)
+
+    def _setDistance(self, distance, narrow):
+        if narrow:
+            self.band = ~MA.getmaskarray(distance).flatten()
+            self.band_ids = np.flatnonzero(self.band)
+            sign = np.sign(np.array(self._value))
+            self._value = np.where(self.band, MA.filled(distance, 0).flatten(), sign * narrow)
+        else:
+            self.band = np.ones(self.mesh.numberOfCells, dtype=bool)
+            self.band_ids = np.arange(self.mesh.numberOfCells)
+            self._value = np.array(distance).flatten()
+        self._markFresh()
+
+    def extendVariable(self, extensionVariable, order=2):
+        narrow = self.getNarrow()
+        if narrow is None:
+            super(DistanceVariableNonUniform, self).extendVariable(extensionVariable, order=order)
+            return
+
+        import skfmm
+        dx, shape = self.getLSMshape()
+        phi = np.array(self._value).reshape(shape)
+        extensionValue = np.array(extensionVariable.value).reshape(shape)
+        _, extensionValue = skfmm.extension_velocities(phi, extensionValue,
+                                                       ext_mask=phi < 0., dx=dx,
+                                                       order=order, narrow=narrow)
+        extensionVariable[:] = MA.filled(extensionValue, 0).flatten()
+
+    def reinitializeAndExtend(self, extensionVariable, order=1, narrow=None):
+        """Reinitialize the distance and extend a variable in one pass.
+
+        A single fast marching pass recalculates the signed distance
+        and extends `extensionVariable` from the zero level set.
+
+        Args:
+            extensionVariable: the variable to extend
+            order: the order of accuracy of the fast marching
+            narrow: the width of the band around the zero level set
+                to march over, the default is the `params.narrow_band`
+                width and the whole mesh if that is not set.
+
+        """
+        import skfmm
+        if narrow is None:
+            narrow = self.getNarrow()
+        dx, shape = self.getLSMshape()
+        phi = np.array(self._value).reshape(shape)
+        extensionValue = np.array(extensionVariable.value).reshape(shape)
+        distance, extensionValue = skfmm.extension_velocities(phi, extensionValue,
+                                                              ext_mask=phi < 0., dx=dx,
+                                                              order=order, narrow=narrow or 0.)
+        self._setDistance(distance, narrow)
+        extensionVariable[:] = MA.filled(extensionValue, 0).flatten()
+
     def deleteIslands(self):
-        cellToCellIDs = self.mesh._cellToCellIDs
-        adjVals = numerix.take(self.value, cellToCellIDs)
-        adjInterfaceValues = MA.masked_array(adjVals, mask = (adjVals * self.value) > 0)
-        masksum = numerix.sum(numerix.logical_not(MA.getmask(adjInterfaceValues)), 0)
-        tmp = MA.logical_and(masksum == 4, self.value > 0)
-        self.value = numerix.array(MA.where(tmp, -1, self.value))
+        """Remove small disconnected regions of either sign.
+
+        Electrolyte regions not connected to the top of the domain and
+        metal regions not connected to the bottom are found by
+        labelling the (ny, nx) grid. Regions with at most
+        `params.island_size` cells have their sign flipped. The
+        remaining disconnected electrolyte regions are recorded in
+        `voids` as dictionaries with the number of cells, the volume
+        and the centroid of each void.
+
+        Returns:
+            the voids
+        """
+        dx, shape = self.getLSMshape()
+        phi = np.array(self.value).reshape(shape)
+        volumes = np.array(self.mesh.cellVolumes).reshape(shape)
+        x, y = [np.array(c).reshape(shape) for c in self.mesh.cellCenters]
+        self.voids = []
+        for sign, attached_row in ((1, -1), (-1, 0)):
+            labels, number = ndimage.label(sign * phi > 0)
+            sizes = np.bincount(labels.flatten(), minlength=number + 1)
+            detached = np.setdiff1d(np.arange(1, number + 1), labels[attached_row])
+            islands = detached[sizes[detached] <= self.island_size]
+            phi[np.isin(labels, islands)] = -sign
+            if sign > 0:
+                for label in detached[sizes[detached] > self.island_size]:
+                    mask = labels == label
+                    volume = volumes[mask].sum()
+                    self.voids.append(dict(cells=int(sizes[label]),
+                                           volume=volume,
+                                           x=(x * volumes)[mask].sum() / volume,
+                                           y=(y * volumes)[mask].sum() / volume))
+        self.value = phi.flatten()
+        return self.voids
 
 
 class AreaVariable(fp.Variable):
@@ -139,6 +328,80 @@ class CapVariable(fp.CellVariable):
         return np.where(radius > cap_radius, 0, 1)
 
 
+class _KineticsComponentVariable(fp.CellVariable):
+    def __init__(self, kinetics, index):
+        super(_KineticsComponentVariable, self).__init__(kinetics.mesh, hasOld=False)
+        self.kinetics = self._requires(kinetics)
+        self.index = index
+
+    def _calcValue(self):
+        return self.kinetics.value[self.index]
+
+
+class KineticsVariable(fp.CellVariable):
+    """The electrode kinetics evaluated in a single pass.
+
+    All the kinetic quantities are calculated together from the
+    potential, cupric concentration and interface coverage, sharing
+    the four exponentials, and only in the cells where the interface
+    area is non-zero. They are written into one preallocated array
+    and are zero elsewhere. Each quantity is available as a cell
+    variable in `components` keyed by the names in `keys`.
+    """
+    keys = ('beta_forward0', 'beta_backward0', 'beta_forward1', 'beta_backward1',
+            'baseCurrent', 'currentDensity', 'currentDerivative',
+            'currentThetaDerivative', 'depositionRate')
+
+    def __init__(self, params, variables):
+        super(KineticsVariable, self).__init__(variables.distance.mesh, elementshape=(len(self.keys),))
+        self.params = params
+        self.coeffs = (variables.coeff_forward0, variables.coeff_backward0,
+                       variables.coeff_forward1, variables.coeff_backward1)
+        self.potential = self._requires(variables.potential)
+        self.cupric = self._requires(variables.cupric)
+        self.interfaceTheta = self._requires(variables.interfaceTheta)
+        self.distance = self._requires(variables.distance)
+        self._buffer = np.zeros((len(self.keys), self.mesh.numberOfCells))
+        self._ids = np.arange(0)
+        self.components = dict((key, _KineticsComponentVariable(self, index))
+                               for index, key in enumerate(self.keys))
+
+    def _calcValue(self):
+        params = self.params
+        buffer = self._buffer
+        ## the rates must be zero off the interface, most consumers
+        ## multiply them by the interface area but the kMinus *
+        ## depositionRate sink in the theta equations does not
+        buffer[:, self._ids] = 0
+        ids = self._ids = self.distance.interfaceGeometry['interfaceIDs']
+
+        potential = np.array(self.potential)[ids]
+        cbar = np.array(self.cupric)[ids] / params.bulkCupric
+        theta = np.array(self.interfaceTheta)[ids]
+        coeff_forward0, coeff_backward0, coeff_forward1, coeff_backward1 = self.coeffs
+        exp_forward0 = np.exp(coeff_forward0 * potential)
+        exp_backward0 = np.exp(-coeff_backward0 * potential)
+        exp_forward1 = np.exp(coeff_forward1 * potential)
+        exp_backward1 = np.exp(-coeff_backward1 * potential)
+        I0 = params.i0 * (1 - theta)
+        I1 = params.i1 * theta
+
+        values = np.empty((len(self.keys), len(ids)))
+        values[0] = cbar * I0 * exp_forward0
+        values[1] = cbar * I0 * exp_backward0
+        values[2] = cbar * I1 * exp_forward1
+        values[3] = cbar * I1 * exp_backward1
+        values[4] = I0 * (exp_forward0 - exp_backward0) + I1 * (exp_forward1 - exp_backward1)
+        values[5] = cbar * values[4]
+        values[6] = coeff_forward0 * values[0] + coeff_backward0 * values[1] \
+                    + coeff_forward1 * values[2] + coeff_backward1 * values[3]
+        values[7] = cbar * (params.i1 * (exp_forward1 - exp_backward1) \
+                            - params.i0 * (exp_forward0 - exp_backward0))
+        values[8] = values[5] * params.omega / params.charge / params.faradaysConstant
+        buffer[:, ids] = values
+        return buffer
+
+
 class Variables(object):
     def __init__(self, params, mesh):
         self.potential = PotentialVariable(params, mesh)
@@ -164,25 +427,9 @@ class Variables(object):
         self.coeff_backward0 = (params.alpha_ - params.alpha0) * Fbar
         self.coeff_forward1 = params.alpha1 * Fbar
         self.coeff_backward1 = (params.alpha_ - params.alpha1) * Fbar
-        exp_forward0 = numerix.exp(self.coeff_forward0 * self.potential)
-        exp_backward0 = numerix.exp(-self.coeff_backward0 * self.potential)
-        exp_forward1 = numerix.exp(self.coeff_forward1 * self.potential)
-        exp_backward1 = numerix.exp(-self.coeff_backward1 * self.potential)
-        cbar =  self.cupric / params.bulkCupric
-
-        I0 = params.i0 * (1 - self.interfaceTheta)
-        I1 = params.i1 * self.interfaceTheta
-
-        self.beta_forward0 = cbar * I0 * exp_forward0
-        self.beta_backward0 = cbar * I0 * exp_backward0
-        self.beta_forward1 = cbar * I1 * exp_forward1
-        self.beta_backward1 = cbar * I1 * exp_backward1
-
-        self.baseCurrent = I0 * (exp_forward0 - exp_backward0) + I1 * (exp_forward1 - exp_backward1)
-        self.currentDensity = cbar * self.baseCurrent
-        self.currentDerivative = cbar * (I0 * (self.coeff_forward0 *  exp_forward0 + self.coeff_backward0 * exp_backward0) \
-                                         + I1 * (self.coeff_forward1 *  exp_forward1 + self.coeff_backward1 * exp_backward1))
-        self.depositionRate = self.currentDensity * params.omega / params.charge / params.faradaysConstant
+        self.kinetics = KineticsVariable(params, self)
+        for key in KineticsVariable.keys:
+            setattr(self, key, self.kinetics.components[key])
 
 
 class MaskedVariablesCorner(Variables):
@@ -3,6 +3,7 @@ import os
 
 import tables
 from extremefill2D.dicttable import DictTable
+from extremefill2D.tools import interface_norm
 import pylab
 import numpy as np
 from sumatra.projects import load_project
@@ -47,13 +48,29 @@ class BaseViewer(object):
         t1 = data[index]['elapsedTime']
 
         alpha = (time - t0) / (t1 - t0)
-        phi0 = data[index - indexJump]['distance']
+        grid0 = self.getGrid(data, index - indexJump)
+        grid1 = self.getGrid(data, index)
+        phi0 = self.interpolate(data[index - indexJump]['distance'], grid0, grid1)
         phi1 = data[index]['distance']
-        return phi0 * (1 - alpha) + phi1 * alpha
-
-    def getGrid(self, data):
+        return phi0 * (1 - alpha) + phi1 * alpha, grid1
+
+    def getGrid(self, data, index=0):
+        from extremefill2D.meshes import record_grid, record_grid_key
+        record = data[index]
+        args = (record['nx'], record['ny'], record['dx'], record['dy'])
+        origin = record.get('origin', (0., 0.))
+        key = record_grid_key(*args, origin=origin)
+        if not hasattr(data, 'grids'):
+            data.grids = {}
+        if key not in data.grids:
+            data.grids[key] = record_grid(*args, origin=origin)
+        return data.grids[key]
+
+    def interpolate(self, phi, grid, toGrid):
+        if grid is toGrid:
+            return phi
         import fipy as fp
-        return fp.Grid2D(nx=data[0]['nx'], ny=data[0]['ny'], dx=data[0]['dx'], dy=data[0]['dy'])
+        return np.array(fp.CellVariable(mesh=grid, value=phi)(toGrid.cellCenters, order=1))
 
     def plot(self, filename=None, filedir=None):
         raise NotImplementedError
@@ -77,28 +94,18 @@ class NormViewer(BaseViewer):
 
     def __getNormData(self, data):
         norms = []
-        dx = self.basedata[0]['dx']
 
         if hasattr(self.basedata, 'index'):
             del self.basedata.index
 
         for time in self.times:
-            phiBase = self.getInterpolatedDistanceFunction(time, self.basedata)
-            phi = self.getInterpolatedDistanceFunction(time, data)
-            phiInt = self.__interpolateToBase(self.basedata, data, phi)
-            diff = abs(phiInt - phiBase) / dx
-            diff[abs(phiBase) > 10 * dx] = 0.
-            norm2 = np.sqrt(np.sum(diff**2) / len(diff))
-            norms.append(norm2)
+            phiBase, baseGrid = self.getInterpolatedDistanceFunction(time, self.basedata)
+            phi, grid = self.getInterpolatedDistanceFunction(time, data)
+            phiInt = self.interpolate(phi, grid, baseGrid)
+            norms.append(interface_norm(phiInt, phiBase, np.min(baseGrid.dx)))
 
         return np.array(self.times), np.array(norms)
 
-    def __interpolateToBase(self, basedata, data, phi):
-        baseGrid = self.getGrid(basedata)
-        grid = self.getGrid(data)
-        import fipy as fp
-        return np.array(fp.CellVariable(mesh=grid, value=phi)(baseGrid.cellCenters, order=1))
-
 
 class _ContourViewer(BaseViewer):
     def __init__(self, basedatafile=None, datafiles=None, labels=None, times=None, contours=(0,), colors=None):
@@ -128,11 +135,10 @@ class _ContourViewer(BaseViewer):
 
     def __addDataAtTime(self, datafile, time, color):
         data = DictTable(datafile, 'r')
-        mesh = self.getGrid(data)
+        phi, mesh = self.getInterpolatedDistanceFunction(time, data)
         shape = (mesh.ny, mesh.nx)
         x = np.reshape(mesh.x.value, shape)
         y = np.reshape(mesh.y.value, shape)
-        phi = self.getInterpolatedDistanceFunction(time, data)
         phi = np.reshape(phi, shape)
         self.data.append((x, y, phi, color))
 
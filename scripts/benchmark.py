@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Time the simulation hot paths at a range of grid resolutions.
+
+Each benchmark is timed as the best of `--repeat` calls after an
+untimed setup, and the peak memory allocated during one further call
+is measured with tracemalloc. The results are written as JSON. With
+`--baseline` the results are compared with a stored set of results
+and any benchmark slower than the baseline by more than `--tolerance`
+is flagged, in which case the exit status is 1.
+
+Usage: benchmark.py [<jsonfile>] [--Nx=<Nx>] [--repeat=<repeat>] [--output=<output>] [--baseline=<baseline>] [--tolerance=<tolerance>]
+
+Options:
+  --Nx=<Nx>                comma separated grid resolutions [default: 100,300,600,1200]
+  --repeat=<repeat>        number of timed calls [default: 3]
+  --output=<output>        file for the JSON results [default: benchmark.json]
+  --baseline=<baseline>    JSON results to compare with
+  --tolerance=<tolerance>  allowed fractional slow down [default: 0.2]
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+
+from collections import namedtuple, OrderedDict
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+
+from docopt import docopt
+from extremefill2D.meshes import ExtremeFill2DMesh
+from extremefill2D.variables import Variables
+from extremefill2D.systems import ExtremeFillSystem
+from extremefill2D.equations import AdvectionEquation, get_advection_equation
+from extremefill2D.tools import WriteCupricData
+from extremefill2D.featureProperty import FeatureProperty
+
+
+def make_params(params_dict, Nx):
+    params_dict = dict(params_dict, Nx=Nx)
+    return namedtuple('ParamClass', params_dict.keys())(*params_dict.values())
+
+
+def bench_mesh(params, tmpdir):
+    return lambda: ExtremeFill2DMesh(params)
+
+
+def bench_variables(params, tmpdir):
+    mesh = ExtremeFill2DMesh(params)
+    return lambda: Variables(params, mesh)
+
+
+def _system(params):
+    system = ExtremeFillSystem(params)
+    system.updateOld()
+    system.extend(reinitialize=True)
+    return system
+
+
+def bench_sweep(params, tmpdir):
+    system = _system(params)
+    return lambda: system.sweep(params.dt)
+
+
+def bench_sweep_stencil(params, tmpdir):
+    return bench_sweep(make_params(dict(params._asdict(), backend='stencil'), params.Nx), tmpdir)
+
+
+def bench_extend(params, tmpdir):
+    system = _system(params)
+    return system.extend
+
+
+def bench_calcDistanceFunction(params, tmpdir):
+    distance = _system(params).distance
+    return distance.calcDistanceFunction
+
+
+def bench_deleteIslands(params, tmpdir):
+    distance = _system(params).distance
+    return distance.deleteIslands
+
+
+def bench_advection(params, tmpdir):
+    system = _system(params)
+    advection = get_advection_equation(params, system.variables)
+    return lambda: advection.solve(params.dt)
+
+
+def bench_advection_implicit(params, tmpdir):
+    system = _system(params)
+    advection = AdvectionEquation(params, system.variables)
+    return lambda: advection.solve(params.dt)
+
+
+def bench_write(params, tmpdir):
+    system = _system(params)
+    writer = WriteCupricData(os.path.join(tmpdir, 'write.h5'))
+    return lambda: writer.write(0., 0, system.variables)
+
+
+def bench_feature_property(params, tmpdir):
+    system = _system(params)
+    WriteCupricData(os.path.join(tmpdir, 'data.h5')).write(0., 0, system.variables)
+    record = SimpleNamespace(datastore=SimpleNamespace(root=tmpdir),
+                             output_data=[SimpleNamespace(path='data.h5')],
+                             parameters=params._asdict())
+
+    def analyze():
+        feature = FeatureProperty(record)
+        feature.getHeight()
+        feature.getVoidSize()
+        feature.close()
+
+    return analyze
+
+
+BENCHMARKS = OrderedDict([('mesh', bench_mesh),
+                          ('variables', bench_variables),
+                          ('sweep', bench_sweep),
+                          ('sweep_stencil', bench_sweep_stencil),
+                          ('extend', bench_extend),
+                          ('calcDistanceFunction', bench_calcDistanceFunction),
+                          ('deleteIslands', bench_deleteIslands),
+                          ('advection', bench_advection),
+                          ('advection_implicit', bench_advection_implicit),
+                          ('write', bench_write),
+                          ('feature_property', bench_feature_property)])
+
+
+def time_call(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak / 1024.**2
+
+
+def run_benchmarks(params_dict, Nxs, repeat=3, names=None):
+    """Run the benchmarks.
+
+    Returns a list of dictionaries with the name, Nx, time in seconds
+    and peak memory in MB of each benchmark.
+    """
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for Nx in Nxs:
+            params = make_params(params_dict, Nx)
+            for name, bench in BENCHMARKS.items():
+                if names is not None and name not in names:
+                    continue
+                seconds, memory = time_call(bench(params, tmpdir), repeat)
+                results.append(OrderedDict([('name', name),
+                                            ('Nx', Nx),
+                                            ('time', seconds),
+                                            ('peak_memory_mb', memory)]))
+                print('{0:>22} {1:6d} {2:12.4e} s {3:10.2f} MB'.format(name, Nx, seconds, memory))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare the results with the baseline.
+
+    Returns a list of (name, Nx, ratio) for the benchmarks that are
+    slower than the baseline by more than `tolerance`.
+
+    >>> baseline = [dict(name='sweep', Nx=100, time=1.0)]
+    >>> compare([dict(name='sweep', Nx=100, time=1.5)], baseline)
+    [('sweep', 100, 1.5)]
+    >>> compare([dict(name='sweep', Nx=100, time=1.1)], baseline)
+    []
+    """
+    baseline = dict(((r['name'], r['Nx']), r['time']) for r in baseline)
+    regressions = []
+    for result in results:
+        key = (result['name'], result['Nx'])
+        if key in baseline:
+            ratio = result['time'] / baseline[key]
+            if ratio > 1 + tolerance:
+                regressions.append(key + (ratio,))
+    return regressions
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='Run benchmark.py')
+    jsonfile = arguments['<jsonfile>'] or os.path.join(os.path.split(__file__)[0], 'params.json')
+    with open(jsonfile, 'r') as ff:
+        params_dict = json.load(ff)
+    Nxs = [int(Nx) for Nx in arguments['--Nx'].split(',')]
+
+    results = run_benchmarks(params_dict, Nxs, repeat=int(arguments['--repeat']))
+    with open(arguments['--output'], 'w') as ff:
+        json.dump(results, ff, indent=2)
+
+    if arguments['--baseline']:
+        with open(arguments['--baseline'], 'r') as ff:
+            baseline = json.load(ff)
+        regressions = compare(results, baseline, float(arguments['--tolerance']))
+        for name, Nx, ratio in regressions:
+            print('regression: {0} at Nx={1} is {2:.2f} times slower than the baseline'.format(name, Nx, ratio))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compare the quasi-steady potential solve with the transient potential
+equation. Both runs use the same parameters apart from
+`quasi_steady_potential` and the relative L2 difference of each field
+at the end of the runs is printed with the run times.
+
+Usage: quasi_steady_benchmark.py [<jsonfile>] [--steps=<steps>]
+
+Options:
+  --steps=<steps>  number of time steps [default: 40]
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+
+from collections import namedtuple
+import json
+import os
+import time
+
+
+from docopt import docopt
+import numpy as np
+from extremefill2D.systems import ExtremeFillSystem
+
+
+FIELDS = ('distance', 'potential', 'cupric', 'suppressor', 'theta')
+
+
+def run(params_dict, quasi_steady):
+    params_dict = dict(params_dict, quasi_steady_potential=quasi_steady)
+    params = namedtuple('ParamClass', params_dict.keys())(*params_dict.values())
+    system = ExtremeFillSystem(params)
+    t0 = time.time()
+    system.run(print_data=False)
+    return system, time.time() - t0
+
+
+def compare(params_dict):
+    transient, transient_time = run(params_dict, False)
+    steady, steady_time = run(params_dict, True)
+    print('{0:>12} {1:>12} {2:>12}'.format('', 'transient', 'quasi-steady'))
+    print('{0:>12} {1:12.3f} {2:12.3f}'.format('time (s)', transient_time, steady_time))
+    print('{0:>12} {1:12d} {2:12d}'.format('solves',
+                                           transient.equations[0].solve_count,
+                                           steady.equations[0].solve_count))
+    print('{0:>12} {1:12.4e} {2:12.4e}'.format('elapsed', transient.elapsedTime, steady.elapsedTime))
+    print('')
+    print('relative L2 difference')
+    for field in FIELDS:
+        value = np.array(getattr(transient.variables, field))
+        other = np.array(getattr(steady.variables, field))
+        print('{0:>12} {1:12.4e}'.format(field, np.linalg.norm(value - other) / np.linalg.norm(value)))
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='Run quasi_steady_benchmark.py')
+    jsonfile = arguments['<jsonfile>'] or os.path.join(os.path.split(__file__)[0], 'params.json')
+    with open(jsonfile, 'r') as ff:
+        params_dict = json.load(ff)
+    params_dict['totalSteps'] = int(arguments['--steps'])
+    compare(params_dict)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Run a matrix of `Nx`, `CFL` and `sweeps` settings to the same
+simulation time and tabulate the cost against the accuracy of each run.
+
+The accuracy is the L2 interface norm used by `viewer.NormViewer`, the
+difference between the level set of the run interpolated onto the grid
+of the reference and the level set of the reference, in units of the
+reference grid spacing. The reference is either the golden data in
+`--reference` (the latest record of a file written by `DataWriter`),
+in which case the runs go to the time of that record, or the run with
+the finest settings in the matrix, in which case the runs go to
+`--time`. The table is sorted by run time and the cheapest run with an
+error below `--target` is reported.
+
+Usage: scaling_study.py [<jsonfile>] [--Nx=<Nx>] [--CFL=<CFL>] [--sweeps=<sweeps>] [--time=<time>] [--reference=<reference>] [--target=<target>] [--output=<output>]
+
+Options:
+  --Nx=<Nx>                comma separated grid resolutions [default: 50,100,200]
+  --CFL=<CFL>              comma separated CFL numbers [default: 0.05,0.1,0.2]
+  --sweeps=<sweeps>        comma separated maximum sweeps [default: 1,2,4]
+  --time=<time>            simulation time without a reference file [default: 1.0]
+  --reference=<reference>  golden data file to compare with
+  --target=<target>        the required L2 interface error [default: 0.1]
+  --output=<output>        CSV file for the table [default: scaling.csv]
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+
+from collections import namedtuple, OrderedDict
+import itertools
+import json
+import os
+import time
+
+
+from docopt import docopt
+import numpy as np
+import pandas as pd
+from extremefill2D.dicttable import DictTable
+from extremefill2D.meshes import record_grid
+from extremefill2D.systems import ExtremeFillSystem
+from extremefill2D.tools import interface_norm
+
+
+Reference = namedtuple('Reference', ['mesh', 'distance', 'dx', 'time'])
+
+
+def read_reference(datafile, featureDepth):
+    """Read the latest level set from a `DataWriter` file on the grid
+    given by `record_grid`.
+    """
+    data = DictTable(datafile, 'r')
+    record = data[data.getLatestIndex()]
+    mesh = record_grid(record['nx'], record['ny'], record['dx'], record['dy'],
+                       origin=record.get('origin'), featureDepth=featureDepth)
+    return Reference(mesh, record['distance'], min(record['dx']), float(record['elapsedTime']))
+
+
+def run(params_dict, Nx, CFL, sweeps, total_time):
+    """Run to `total_time` and return the system and the run time.
+    """
+    params_dict = dict(params_dict, Nx=Nx, CFL=CFL, sweeps=sweeps,
+                       totalTime=total_time, totalSteps=10**9)
+    params = namedtuple('ParamClass', params_dict.keys())(*params_dict.values())
+    system = ExtremeFillSystem(params)
+    t0 = time.time()
+    system.run(print_data=False)
+    return system, time.time() - t0
+
+
+def reference_from_system(system):
+    mesh = system.distance.mesh
+    return Reference(mesh, np.array(system.distance), mesh.nominal_dx, system.elapsedTime)
+
+
+def interface_error(system, reference):
+    """The L2 interface norm of the run against the reference.
+    """
+    phiInt = np.array(system.distance(reference.mesh.cellCenters, order=1))
+    return interface_norm(phiInt, reference.distance, reference.dx)
+
+
+def scaling_study(params_dict, Nxs, CFLs, sweeps, total_time=1.0, reference=None, target=0.1):
+    """Run the matrix of settings.
+
+    Returns a DataFrame with the settings, the run time, the number of
+    accepted and rejected steps and the interface error of each run,
+    sorted by the run time, and the cheapest row meeting the target or
+    None.
+    """
+    runs = list(itertools.product(Nxs, CFLs, sweeps))
+    systems = dict()
+    if reference is None:
+        finest = (max(Nxs), min(CFLs), max(sweeps))
+        systems[finest] = run(params_dict, *finest, total_time=total_time)
+        reference = reference_from_system(systems[finest][0])
+
+    rows = []
+    for settings in runs:
+        if settings not in systems:
+            systems[settings] = run(params_dict, *settings, total_time=reference.time)
+        system, run_time = systems[settings]
+        rows.append(OrderedDict([('Nx', settings[0]),
+                                 ('CFL', settings[1]),
+                                 ('sweeps', settings[2]),
+                                 ('time (s)', run_time),
+                                 ('steps', system.accepted_steps),
+                                 ('rejected', system.rejected_steps),
+                                 ('L2 error', interface_error(system, reference))]))
+    table = pd.DataFrame(rows).sort_values('time (s)').reset_index(drop=True)
+    table['meets target'] = table['L2 error'] <= target
+    passing = table[table['meets target']]
+    cheapest = passing.iloc[0] if len(passing) > 0 else None
+    return table, cheapest
+
+
+def parse_list(s, dtype):
+    return [dtype(v) for v in s.split(',')]
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__, version='Run scaling_study.py')
+    jsonfile = arguments['<jsonfile>'] or os.path.join(os.path.split(__file__)[0], 'params.json')
+    with open(jsonfile, 'r') as ff:
+        params_dict = json.load(ff)
+
+    reference = None
+    if arguments['--reference']:
+        reference = read_reference(arguments['--reference'], params_dict['featureDepth'])
+
+    table, cheapest = scaling_study(params_dict,
+                                    parse_list(arguments['--Nx'], int),
+                                    parse_list(arguments['--CFL'], float),
+                                    parse_list(arguments['--sweeps'], int),
+                                    total_time=float(arguments['--time']),
+                                    reference=reference,
+                                    target=float(arguments['--target']))
+    table.to_csv(arguments['--output'], index=False)
+    print(table.to_string(index=False))
+    print('')
+    if cheapest is None:
+        print('no settings meet the target')
+    else:
+        print('cheapest settings meeting the target: Nx={0}, CFL={1}, sweeps={2}'.format(cheapest['Nx'],
+                                                                                          cheapest['CFL'],
+                                                                                          cheapest['sweeps']))
@@ -15,7 +15,7 @@ import tempfile
 
 
 from docopt import docopt
-from extremefill2D.systems import ExtremeFillSystem
+from extremefill2D.systems import run_continuation
 # from extremefill2D.systems import ConstantCurrentSystem
 from extremefill2D.tools import WriteCupricData
 
@@ -34,9 +34,8 @@ if __name__ == '__main__':
 
     dataWriter = WriteCupricData(datafile)
 
-    system = ExtremeFillSystem(params, dataWriter)
-    # system = ConstantCurrentSystem(params, dataWriter)
-    system.run()
+    system = run_continuation(params, dataWriter)
+    # system = run_continuation(params, dataWriter, system_class=ConstantCurrentSystem)
 
     if not hasattr(params, 'sumatra_label'):
         sumatra_label = '.'
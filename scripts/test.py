@@ -5,8 +5,10 @@ import os
 
 import tables
 import numpy as np
-from extremefill2D.systems import ExtremeFillSystem, ConstantCurrentSystem
-from extremefill2D.meshes import ExtremeFill2DMesh
+from extremefill2D.systems import ExtremeFillSystem, ConstantCurrentSystem, continuation_ladder, run_continuation
+from extremefill2D.meshes import ExtremeFill2DMesh, get_mesh
+from extremefill2D.solvers import CachedLUSolver
+from extremefill2D.tools import interface_norm
 
 
 def assert_close(v1, v2, **kwargs):
@@ -57,6 +59,12 @@ def test_constant_current():
     system.run(print_data=False)
     assert_close(float(system.variables.current), params.current)
 
+def test_constant_current_newton():
+    params = read_params(jsonfile=constant_current_json(), totalSteps=1, sweeps=8)
+    system = ConstantCurrentSystem(params)
+    system.run(print_data=False)
+    assert np.isclose(float(system.variables.current), params.current, rtol=1e-8, atol=0)
+
 def test_mesh():
     params = read_params()
     mesh = ExtremeFill2DMesh(params)
@@ -111,5 +119,536 @@ def test_hemispherical_cap_retreat():
     phi.setValue(-1)
     assert np.sum(system.variables.cap.value) == 0
 
+def test_cached_lu_solver():
+    import fipy as fp
+    mesh = fp.Grid2D(nx=10, ny=10)
+    var = fp.CellVariable(mesh=mesh, value=0., hasOld=True)
+    var.constrain(1., mesh.facesLeft)
+    coeff = fp.Variable(1.)
+    eqn = fp.TransientTerm() == fp.DiffusionTerm(coeff) - fp.ImplicitSourceTerm(1e-2)
+    solver = CachedLUSolver(reuse_tol=1e-2)
+    for value in (1., 1.001, 2.):
+        coeff.setValue(value)
+        var.setValue(0.)
+        eqn.solve(var, dt=1., solver=solver)
+        expected = var.copy()
+        var.setValue(0.)
+        eqn.solve(var, dt=1., solver=fp.LinearLUSolver())
+        assert_close(var, expected)
+    assert solver.symbolic_count == 1
+    assert solver.reuse_count == 1
+    assert solver.numeric_count == 1
+
+def test_krylov_solvers():
+    attrs = ['potential', 'cupric', 'suppressor', 'theta']
+    params = read_params(totalSteps=2)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    solver = dict(potential='gmres+ilu', cupric='bicgstab+ilu', suppressor='gmres+jacobi')
+    params_krylov = read_params(totalSteps=2, solver=solver)
+    system_krylov = ExtremeFillSystem(params_krylov)
+    system_krylov.run(print_data=False)
+    for attr in attrs:
+        assert_close(getattr(system_krylov.variables, attr),
+                     getattr(system.variables, attr), rtol=1e-4, atol=1e-8)
+
+def test_coupled():
+    attrs = ['potential', 'cupric', 'suppressor', 'theta']
+    params = read_params(totalSteps=1, sweeps=16)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    params_coupled = read_params(totalSteps=1, sweeps=8, coupled=True)
+    system_coupled = ExtremeFillSystem(params_coupled)
+    system_coupled.run(print_data=False)
+    for attr in attrs:
+        v = np.array(getattr(system_coupled.variables, attr))
+        o = np.array(getattr(system.variables, attr))
+        assert np.max(abs(v - o)) < 1e-3 * np.max(abs(o))
+
+def test_adaptive_sweeps():
+    attrs = ['potential', 'cupric', 'suppressor', 'theta']
+    params = read_params(totalSteps=3)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    params_adaptive = read_params(totalSteps=3, sweeps=10, tol=dict(potential=1e-4, cupric=1e-4, suppressor=1e-4))
+    system_adaptive = ExtremeFillSystem(params_adaptive)
+    system_adaptive.run(print_data=False)
+    sweeps = [n for _, n, _ in system_adaptive.convergence_history]
+    assert len(sweeps) == 3
+    assert max(sweeps) < 10
+    for attr in attrs:
+        v = np.array(getattr(system_adaptive.variables, attr))
+        o = np.array(getattr(system.variables, attr))
+        assert np.max(abs(v - o)) < 1e-3 * np.max(abs(o))
+
+def test_narrow_band():
+    attrs = ['potential', 'cupric', 'suppressor', 'theta']
+    params = read_params(totalSteps=5)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    system_narrow = ExtremeFillSystem(read_params(totalSteps=5, narrow_band=20))
+    system_narrow.run(print_data=False)
+    band = system_narrow.distance.band
+    assert band.sum() < len(band)
+    for attr in attrs + ['distance']:
+        v = np.array(getattr(system_narrow.variables, attr))[band]
+        o = np.array(getattr(system.variables, attr))[band]
+        assert np.allclose(v, o)
+
+def test_explicit_advection():
+    params = read_params(totalSteps=5, advection='implicit')
+    system = ExtremeFillSystem(params)
+    system.advection.solver = CachedLUSolver(criterion='initial')
+    system.run(print_data=False)
+    system_explicit = ExtremeFillSystem(read_params(totalSteps=5, advection='eno2'))
+    system_explicit.run(print_data=False)
+    assert np.allclose(system_explicit.distance, system.distance, rtol=1e-10, atol=1e-14)
+
+def test_narrow_band_advection():
+    system = ExtremeFillSystem(read_params(narrow_band=20))
+    system.extend(reinitialize=True)
+    distance = system.distance
+    band = distance.band
+    assert band.sum() < len(band)
+    phi = np.array(distance)
+    system.advection.solve(1e-2)
+    narrow = np.array(distance)
+    distance.band = np.ones_like(band)
+    distance.setValue(phi)
+    system.advection.solve(1e-2)
+    assert np.all(narrow[~band] == phi[~band])
+    assert np.allclose(narrow[band], np.array(distance)[band], rtol=0, atol=1e-20)
+    assert np.any(narrow[band] != phi[band])
+
+def test_delete_islands():
+    from extremefill2D.variables import DistanceVariableNonUniform
+    params = read_params(island_size=4)
+    mesh = ExtremeFill2DMesh(params)
+    distance = DistanceVariableNonUniform(params, mesh)
+    phi = np.array(distance).reshape(mesh.ny, mesh.nx)
+    phi[:4, :4] = 1.
+    phi[1:3, 10:12] = 1.
+    phi[-2, 5] = -1.
+    distance[:] = phi.flatten()
+    voids = distance.deleteIslands()
+    phi_new = np.array(distance).reshape(mesh.ny, mesh.nx)
+    assert np.all(phi_new[1:3, 10:12] < 0)
+    assert phi_new[-2, 5] > 0
+    assert len(voids) == 1
+    assert voids[0]['cells'] == 16
+    assert np.isclose(voids[0]['volume'], np.array(mesh.cellVolumes).reshape(mesh.ny, mesh.nx)[:4, :4].sum())
+
+def test_void_records(tmpdir):
+    from types import SimpleNamespace
+    from extremefill2D.tools import DataWriter
+    from extremefill2D.featureProperty import FeatureProperty
+    params = read_params(monitor_frequency=1, island_size=4)
+    system = ExtremeFillSystem(params)
+    mesh = system.distance.mesh
+    writer = DataWriter(str(tmpdir.join('data.h5')))
+    writer.write(0., 1, system.variables)
+    phi = np.array(system.distance).reshape(mesh.ny, mesh.nx)
+    phi[:4, :4] = 1.
+    system.distance[:] = phi.flatten()
+    voids = system.distance.deleteIslands()
+    assert len(voids) == 1
+    system.monitor.update()
+    assert_close(system.monitor.void_volume, voids[0]['volume'])
+    assert system.monitor.reason == 'void'
+    writer.write(1., 2, system.variables)
+    record = SimpleNamespace(datastore=SimpleNamespace(root=str(tmpdir)),
+                             output_data=[SimpleNamespace(path='data.h5')],
+                             parameters=params._asdict())
+    feature = FeatureProperty(record)
+    assert feature.getVoids(1) == []
+    assert feature.getVoids(2) == voids
+    assert_close(feature.getVoidVolume(), voids[0]['volume'])
+    feature.close()
+
+def test_interface_geometry_cache():
+    misses = []
+    for totalSteps in (3, 5):
+        system = ExtremeFillSystem(read_params(totalSteps=totalSteps))
+        system.run(print_data=False)
+        misses.append(system.distance.geometry_misses)
+        assert system.distance.geometry_hits > system.distance.geometry_misses
+    assert misses[1] - misses[0] == 2
+
+def test_kinetics():
+    from extremefill2D.variables import Variables
+    params = read_params()
+    variables = Variables(params, ExtremeFill2DMesh(params))
+    variables.potential[:] = -0.1 * (1 + np.random.random(len(variables.potential)))
+    potential = np.array(variables.potential)
+    theta = np.array(variables.interfaceTheta)
+    cbar = np.array(variables.cupric) / params.bulkCupric
+    current = cbar * (params.i0 * (1 - theta) * (np.exp(variables.coeff_forward0 * potential) \
+                                                 - np.exp(-variables.coeff_backward0 * potential)) \
+                      + params.i1 * theta * (np.exp(variables.coeff_forward1 * potential) \
+                                             - np.exp(-variables.coeff_backward1 * potential)))
+    interface = np.array(variables.surface) > 0
+    assert np.allclose(np.array(variables.currentDensity)[interface], current[interface])
+    assert np.all(np.array(variables.currentDensity)[~interface] == 0)
+
+def test_single_extension_per_step():
+    params = read_params(totalSteps=5)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    assert system.extension_history == [2, 1, 1, 1, 1]
+    assert all('extensions' not in residuals for _, _, residuals in system.convergence_history)
+
+def test_reinitialize_and_extend():
+    from extremefill2D.variables import DistanceVariableNonUniform
+    import fipy as fp
+    params = read_params()
+    mesh = ExtremeFill2DMesh(params)
+    distance = DistanceVariableNonUniform(params, mesh)
+    value = np.array(distance) * (1 + mesh.x.value / params.rboundary)
+    speed = 1 + mesh.x.value / params.rboundary
+    distance[:] = value
+    extension = fp.CellVariable(mesh=mesh, value=speed)
+    distance.extendVariable(extension, order=1)
+    distance.calcDistanceFunction(order=1)
+    for narrow in (None, 20 * mesh.nominal_dx):
+        distance_combined = DistanceVariableNonUniform(params, mesh)
+        distance_combined[:] = value
+        extension_combined = fp.CellVariable(mesh=mesh, value=speed)
+        distance_combined.reinitializeAndExtend(extension_combined, narrow=narrow)
+        band = distance_combined.band
+        assert np.allclose(np.array(distance_combined)[band], np.array(distance)[band])
+        assert np.allclose(np.array(extension_combined)[band], np.array(extension)[band])
+
+def test_pi_step_controller():
+    elapsed = []
+    for controller in ('growth', 'pi'):
+        params = read_params(totalSteps=8, dtMax=1e4, dt=1., step_controller=controller)
+        system = ExtremeFillSystem(params)
+        system.run(print_data=False)
+        assert system.accepted_steps == 8
+        assert system.rejected_steps == 0
+        elapsed.append(system.elapsedTime)
+    assert elapsed[1] > 1.5 * elapsed[0]
+
+def test_advection_substeps():
+    systems = []
+    for substeps, steps in ((1, 8), (2, 4)):
+        dt = 0.05 * substeps
+        params = read_params(totalSteps=steps, CFL=0.005, dt=dt, dtMax=dt, dtMin=dt,
+                             advection_substeps=substeps)
+        system = ExtremeFillSystem(params)
+        system.run(print_data=False)
+        assert system.rejected_steps == 0
+        systems.append(system)
+    single, multi = [dict((attr, np.array(getattr(system.variables, attr)))
+                          for attr in ('distance', 'potential', 'cupric')) for system in systems]
+    assert np.isclose(systems[0].elapsedTime, systems[1].elapsedTime)
+    assert np.max(abs(multi['distance'] - single['distance'])) < 1e-3 * np.max(abs(single['distance']))
+    for attr in ('potential', 'cupric'):
+        assert np.max(abs(multi[attr] - single[attr])) < 1e-2 * np.max(abs(single[attr]))
+
+def test_truncated_record(tmpdir):
+    from types import SimpleNamespace
+    from extremefill2D.tools import WriteCupricData
+    from extremefill2D.featureProperty import FeatureProperty
+    params = read_params(totalSteps=2, adaptive_mesh='truncate', monitor_frequency=1)
+    system = ExtremeFillSystem(params)
+    y = np.array(system.distance.mesh.y)
+    system.distance.setValue(np.minimum(np.array(system.distance), y + 30e-6))
+    system.distance.calcDistanceFunction()
+    system.adapt_mesh()
+    assert system.remesh_count == 1
+    system.monitor.update()
+    WriteCupricData(str(tmpdir.join('data.h5'))).write(0., 0, system.variables)
+    record = SimpleNamespace(datastore=SimpleNamespace(root=str(tmpdir)),
+                             output_data=[SimpleNamespace(path='data.h5')],
+                             parameters=params._asdict())
+    feature = FeatureProperty(record)
+    assert_close(feature.getHeight(0), system.monitor.height, atol=1e-3)
+    feature.close()
+
+
+def test_records_across_remesh(tmpdir):
+    from types import SimpleNamespace
+    from extremefill2D.tools import WriteCupricData
+    from extremefill2D.featureProperty import FeatureProperty
+    params = read_params(totalSteps=2, adaptive_mesh='truncate', monitor_frequency=1)
+    system = ExtremeFillSystem(params)
+    y = np.array(system.distance.mesh.y)
+    system.distance.setValue(np.minimum(np.array(system.distance), y + 30e-6))
+    system.distance.calcDistanceFunction()
+    writer = WriteCupricData(str(tmpdir.join('data.h5')))
+    system.monitor.update()
+    heights = [system.monitor.height]
+    writer.write(0., 1, system.variables)
+    system.adapt_mesh()
+    system.monitor.update()
+    heights.append(system.monitor.height)
+    writer.write(0., 2, system.variables)
+    record = SimpleNamespace(datastore=SimpleNamespace(root=str(tmpdir)),
+                             output_data=[SimpleNamespace(path='data.h5')],
+                             parameters=params._asdict())
+    feature = FeatureProperty(record)
+    for index in (1, 2, 1):
+        assert_close(feature.getHeight(index), heights[index - 1], atol=1e-3)
+        assert feature.mesh.numberOfCells == len(feature.h5file.get_node('/ID{0}'.format(index)).distance.read())
+    feature.close()
+
+def test_quasi_steady_potential():
+    systems = []
+    for quasi_steady in (False, True):
+        params = read_params(totalSteps=5, quasi_steady_potential=quasi_steady)
+        system = ExtremeFillSystem(params)
+        system.run(print_data=False)
+        systems.append(system)
+    transient, steady = systems
+    assert steady.equations[0].solve_count == 5
+    assert transient.equations[0].solve_count == 5 * params.sweeps
+    for attr in ['distance', 'potential', 'cupric', 'theta']:
+        value = np.array(getattr(transient.variables, attr))
+        other = np.array(getattr(steady.variables, attr))
+        assert np.linalg.norm(value - other) / np.linalg.norm(value) < 2e-2
+    potential = steady.equations[0]
+    steady.updateOld()
+    residuals = [potential.sweep(steady.dt) for _ in range(2)]
+    assert residuals[0] > 0 and residuals[1] == 0.
+    steady.revert_step(steady.dt)
+    potential.sweep(steady.dt)
+    assert potential.solve_count == 7
+
+def test_fill_monitor():
+    params = read_params(totalSteps=5, monitor_frequency=2)
+    system = ExtremeFillSystem(params)
+    monitor = system.monitor
+    y = np.array(system.distance.mesh.y)
+    distance = np.array(system.distance).copy()
+    assert monitor.update() is None
+    assert_close(monitor.height, 0., atol=1e-10)
+    system.distance.setValue(np.where((y > -30e-6) & (y < -20e-6), 1., -1.) * np.minimum(abs(distance), 1e-6))
+    assert monitor.update() == 'void'
+    assert_close(monitor.void_size, 10e-6 / params.featureDepth, atol=2 * system.distance.mesh.nominal_dx / params.featureDepth)
+    Y = monitor.Y[len(monitor.Y) // 2]
+    system.distance.setValue(y - Y)
+    assert monitor.update() is None
+    assert_close(monitor.getZeros(), [Y])
+    assert_close(monitor.height, (params.featureDepth + Y) / params.featureDepth)
+    system.distance.setValue(y - 1e-6)
+    assert monitor.update() == 'filled'
+    system.run(print_data=False)
+    assert system.termination_reason == 'filled'
+    assert system.elapsedTime == 0.
+    system = ExtremeFillSystem(params)
+    system.distance.setValue(distance)
+    system.run(print_data=False)
+    assert system.termination_reason == 'totalSteps'
+
+def test_profiling(tmpdir):
+    filename = str(tmpdir.join('profile.csv'))
+    params = read_params(totalSteps=3, profile=filename)
+    system = ExtremeFillSystem(params)
+    system.run(print_data=False)
+    totals = system.profiler.totals
+    for name in ['advection', 'potential', 'cupric', 'suppressor', 'theta', 'extension', 'reinitialization', 'islands']:
+        assert totals[name][1] > 0
+    assert totals['advection'][1] == 3
+    assert sum(seconds for seconds, _ in totals.values()) <= system.profiler.elapsed
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'step,phase,seconds,calls,step_peak_memory_mb'
+    assert [line.split(',')[0] for line in lines if ',step,' in line] == ['0', '1', '2']
+    memory = [float(line.split(',')[-1]) for line in lines if ',step,' in line]
+    assert all(m > 0 for m in memory)
+    assert_close(max(memory), system.profiler.peak_memory, atol=0.1)
+    import tracemalloc
+    assert not tracemalloc.is_tracing()
+
+def test_step_logger(tmpdir, capsys):
+    filename = str(tmpdir.join('log.json'))
+    params = read_params(totalSteps=5, log_file=filename, log_every_steps=2)
+    system = ExtremeFillSystem(params)
+    system.run()
+    assert system.logger.stream is None
+    assert capsys.readouterr().out == ''
+    with open(filename) as f:
+        records = [json.loads(line) for line in f]
+    assert [record['step'] for record in records] == [1, 3, 5]
+    names = [eqn.var.name for eqn in system.equations]
+    assert sorted(records[-1]['residuals']) == sorted(names)
+    assert records[-1]['extensions'] == 1
+    from extremefill2D.logger import StepLogger
+    logger = StepLogger(filename=str(tmpdir.join('other.json')))
+    ExtremeFillSystem(read_params(totalSteps=1), logger=logger).run()
+    assert logger.stream is not None
+    logger.close()
+
+def test_fextreme_profile_report():
+    from extremefill2D.fextreme.run_simulation import run
+    from extremefill2D.logger import StepLogger
+    from extremefill2D.profiling import Profiler
+    logger = StepLogger()
+    run(read_params(), total_steps=2, logger=logger, profiler=Profiler())
+    assert logger.report.splitlines()[0].startswith('phase')
+
+def test_benchmark():
+    from scripts.benchmark import run_benchmarks, compare
+    with open(os.path.join(get_path(), 'params.json'), 'r') as ff:
+        params_dict = json.load(ff)
+    results = run_benchmarks(params_dict, [50], repeat=1, names=['sweep', 'extend', 'write', 'feature_property'])
+    assert [r['name'] for r in results] == ['sweep', 'extend', 'write', 'feature_property']
+    assert all(r['time'] > 0 and r['peak_memory_mb'] > 0 for r in results)
+    assert compare(results, results) == []
+    baseline = [dict(r, time=r['time'] / 2) for r in results]
+    assert [r[:2] for r in compare(results, baseline)] == [(r['name'], 50) for r in results]
+
+def test_scaling_study():
+    from scripts.scaling_study import scaling_study, read_reference
+    with open(os.path.join(get_path(), 'params.json'), 'r') as ff:
+        params_dict = json.load(ff)
+    table, cheapest = scaling_study(params_dict, [25, 50], [0.1], [1, 4], total_time=0.05, target=0.1)
+    assert len(table) == 4
+    finest = table[(table['Nx'] == 50) & (table['sweeps'] == 4)].iloc[0]
+    assert finest['L2 error'] < 1e-10
+    assert (cheapest['Nx'], cheapest['sweeps']) == (50, 1)
+    reference = read_reference(os.path.join(get_path(), 'annular.h5'), params_dict['featureDepth'])
+    table, cheapest = scaling_study(params_dict, [100], [0.1], [4], reference=reference, target=1.0)
+    assert table['steps'][0] == 5
+    assert cheapest is not None
+
+def test_adaptive_mesh():
+    params = read_params(totalSteps=3, adaptive_mesh=True, monitor_frequency=1000)
+    system = ExtremeFillSystem(params)
+    y = np.array(system.distance.mesh.y)
+    system.distance.setValue(np.minimum(np.array(system.distance), y + 30e-6))
+    system.distance.calcDistanceFunction()
+    system.monitor.update()
+    height = system.monitor.height
+    def integrals():
+        volumes = np.array(system.distance.mesh.cellVolumes)
+        return [np.sum(np.array(getattr(system.variables, name)) * volumes)
+                for name in ('cupric', 'suppressor', 'potential', 'theta')]
+    before = integrals()
+    ny = system.distance.mesh.shape[1]
+    system.adapt_mesh()
+    assert system.remesh_count == 1
+    assert system.distance.mesh.shape[1] < ny
+    assert_close(integrals(), before, rtol=1e-12)
+    system.monitor.update()
+    assert_close(system.monitor.height, height, atol=1e-4)
+    system.run(print_data=False)
+    assert system.remesh_count == 1
+    assert system.termination_reason == 'totalSteps'
+
+def test_truncated_mesh():
+    systems = []
+    for adaptive_mesh in (False, 'truncate'):
+        params = read_params(totalSteps=2, adaptive_mesh=adaptive_mesh)
+        system = ExtremeFillSystem(params)
+        y = np.array(system.distance.mesh.y)
+        system.distance.setValue(np.minimum(np.array(system.distance), y + 30e-6))
+        system.distance.calcDistanceFunction()
+        systems.append(system)
+    full, truncated = systems
+    volumes = np.array(truncated.distance.mesh.cellVolumes)
+    electrolyte = np.sum(np.array(truncated.variables.cupric) * volumes * (np.array(truncated.distance) > 0))
+    truncated.adapt_mesh()
+    mesh = truncated.distance.mesh
+    assert mesh.bottom > full.distance.mesh.bottom
+    volumes = np.array(mesh.cellVolumes)
+    assert_close(np.sum(np.array(truncated.variables.cupric) * volumes * (np.array(truncated.distance) > 0)), electrolyte)
+    for system in systems:
+        system.run(print_data=False)
+    nx, ny = mesh.shape
+    for name in ('distance', 'potential', 'cupric', 'suppressor'):
+        value = np.array(getattr(full.variables, name)).reshape((-1, nx))[-ny:]
+        other = np.array(getattr(truncated.variables, name)).reshape((ny, nx))
+        assert_close(value[ny // 2:], other[ny // 2:], rtol=1e-8, atol=1e-12)
+
+
+def test_continuation():
+    params = read_params(Nx=50, totalSteps=10**9, totalTime=2.0, continuation=None)
+    assert continuation_ladder(params) == [(50, 2.0)]
+    params = params._replace(continuation=[[25, 1.0]])
+    system = run_continuation(params, print_data=False)
+    assert system.distance.mesh.nominal_dx == params.featureDepth / 50
+    assert_close(system.elapsedTime, 2.0)
+    direct = ExtremeFillSystem(params)
+    direct.run(print_data=False)
+    assert_close(float(system.variables.current), float(direct.variables.current), rtol=2e-2)
+    other = ExtremeFillSystem(params)
+    other.interpolate_from(direct)
+    for name in ('potential', 'cupric', 'suppressor'):
+        assert_close(np.array(getattr(other.variables, name)), np.array(getattr(direct.variables, name)))
+    dx = params.featureDepth / 50
+    assert interface_norm(np.array(other.distance), np.array(direct.distance), dx) < 0.05
+
+
+def test_continuation_early_stop():
+    import pytest
+
+    class Writer(object):
+        records = []
+
+        def write(self, elapsedTime, timeStep, variables):
+            self.records.append((elapsedTime, timeStep, variables.distance.mesh.nominal_dx))
+
+    params = read_params(Nx=50, totalSteps=2, totalTime=2.0, continuation=[[25, 1.0]])
+    with pytest.warns(UserWarning, match='totalSteps'):
+        system = run_continuation(params, Writer(), print_data=False)
+    assert system.termination_reason == 'totalSteps'
+    assert Writer.records == [(system.elapsedTime, 2, params.featureDepth / 25)]
+
+
+def test_continuation_records(tmpdir):
+    log_file, profile = str(tmpdir.join('log.json')), str(tmpdir.join('profile.csv'))
+    params = read_params(Nx=50, totalSteps=10**9, totalTime=0.2, continuation=[[25, 0.1]],
+                         log_file=log_file, profile=profile)
+    run_continuation(params, print_data=False)
+    with open(log_file) as f:
+        records = [json.loads(line) for line in f]
+    with open(profile) as f:
+        steps = [line for line in f.read().splitlines() if ',step,' in line]
+    assert [record for record in records if 'report' in record] == records[-1:]
+    report = records.pop()['report']
+    assert records[0]['elapsed_time'] < 0.1 < records[-1]['elapsed_time']
+    assert len(steps) == len(records)
+    total = [line for line in report.splitlines() if line.startswith('total')][0]
+    assert int(total.split()[-1]) == len(steps)
+
+
+def test_mesh_cache(tmpdir):
+    params = read_params(totalSteps=5, mesh_cache=str(tmpdir))
+    mesh = ExtremeFill2DMesh(params)
+    for _ in range(2):
+        cached = get_mesh(params)
+        assert_close(cached.cellCenters, mesh.cellCenters)
+        assert_close(cached._cellToCellIDs.filled(-1), mesh._cellToCellIDs.filled(-1))
+    assert len(tmpdir.listdir()) == 1
+    assert get_mesh(params._replace(dt=1.)).numberOfCells == mesh.numberOfCells
+    assert len(tmpdir.listdir()) == 1
+    assert not [f for f in tmpdir.listdir()[0].listdir() if f.ext not in ('.npy', '.json')]
+    truncated = get_mesh(params, coarse_height=20e-6, truncate=True)
+    assert_close(truncated.cellCenters, ExtremeFill2DMesh(params, coarse_height=20e-6, truncate=True).cellCenters)
+    values = []
+    for cache in (None, str(tmpdir)):
+        system = ExtremeFillSystem(params._replace(mesh_cache=cache))
+        system.run(print_data=False)
+        values.append(np.array(system.distance))
+    assert_close(values[0], values[1], rtol=0, atol=0)
+
+
+def test_stencil_backend():
+    systems = [ExtremeFillSystem(read_params(totalSteps=5, backend=backend)) for backend in ('fipy', 'stencil')]
+    for system in systems:
+        system.updateOld()
+        system.extend(reinitialize=True)
+    residuals = [system.sweep(1e-2) for system in systems]
+    for key in residuals[0]:
+        assert_close(residuals[0][key], residuals[1][key])
+    for fipy_eqn, stencil_eqn in zip(*[system.equations for system in systems]):
+        assert_close(np.array(stencil_eqn.var), np.array(fipy_eqn.var), rtol=1e-10, atol=0)
+    for system in systems:
+        system.run(print_data=False)
+    for fipy_eqn, stencil_eqn in zip(*[system.equations for system in systems]):
+        assert_close(np.array(stencil_eqn.var), np.array(fipy_eqn.var), rtol=1e-6, atol=1e-12)
+
 if __name__ == '__main__':
     test()